@@ -1,58 +1,162 @@
 import os
-import json
 import re
-from datetime import datetime, timedelta
-from typing import Optional
-from openai import OpenAI
+import logging
+import time
+import random
+import heapq
+import asyncio
+import threading
+import orjson
+from datetime import date, datetime, timedelta
+from typing import Awaitable, Callable, Optional
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from openai.types.chat import ChatCompletionMessage, ChatCompletionMessageFunctionToolCall
+from openai.types.chat.chat_completion_message_function_tool_call import Function
 from amadeus_client import amadeus_client
 from memory_manager import memory_manager
 from database import DatabaseStorage
-from collections import Counter
+from collections import Counter, OrderedDict
 
+logger = logging.getLogger(__name__)
 db_storage = DatabaseStorage()
 
 
-_iata_display_cache: dict[str, str] = {}
-_iata_country_cache: dict[str, str] = {}
+# Resolved IATA lookups, least recently used first; bounded so stray codes can't grow them forever.
+IATA_CACHE_MAXSIZE = 4096
+_iata_display_cache: OrderedDict[str, str] = OrderedDict()
+_iata_country_cache: OrderedDict[str, str] = OrderedDict()
 
 
-def _iata_display(code: str) -> str:
+def _iata_cache_get(cache: OrderedDict, code: str) -> Optional[str]:
+    value = cache.get(code)
+    if value:
+        cache.move_to_end(code)
+    return value
+
+
+def _iata_cache_set(cache: OrderedDict, code: str, value: str) -> None:
+    cache[code] = value
+    cache.move_to_end(code)
+    while len(cache) > IATA_CACHE_MAXSIZE:
+        cache.popitem(last=False)
+
+
+async def _iata_display(code: str) -> str:
     if not isinstance(code, str):
         return str(code)
     c = code.strip().upper()
     if len(c) != 3:
         return c
 
-    cached = _iata_display_cache.get(c)
+    cached = _iata_cache_get(_iata_display_cache, c)
     if cached:
         return cached
 
-    resolved = amadeus_client.resolve_airport_display(c)
+    resolved = await amadeus_client.resolve_airport_display(c)
     # Cache only if it actually resolved to something more than the code.
     if isinstance(resolved, str) and resolved.strip() and resolved.strip().upper() != c:
-        _iata_display_cache[c] = resolved
+        _iata_cache_set(_iata_display_cache, c, resolved)
     return resolved
 
 
-def _iata_country(code: str) -> str | None:
+async def _iata_country(code: str) -> str | None:
     if not isinstance(code, str):
         return None
     c = code.strip().upper()
     if len(c) != 3:
         return None
 
-    cached = _iata_country_cache.get(c)
+    cached = _iata_cache_get(_iata_country_cache, c)
     if cached:
         return cached
 
-    country = amadeus_client.resolve_airport_country(c)
+    country = await amadeus_client.resolve_airport_country(c)
     if isinstance(country, str) and country.strip():
-        _iata_country_cache[c] = country.strip()
-        return _iata_country_cache[c]
+        country = country.strip()
+        _iata_cache_set(_iata_country_cache, c, country)
+        return country
     return None
 
 
-def _compute_most_travelled_countries(user_id: str, limit: int = 3) -> list[dict]:
+# Route shapes found in travel-history memory text ("IAH → KTM", "from IAH to KTM",
+# "Houston (IAH) ... Kathmandu (KTM)").
+_ARROW_ROUTE_RE = re.compile(r"\b([A-Z]{3})\b\s*(?:→|->)\s*\b([A-Z]{3})\b")
+# Run against lowercased text (cheaper than re.IGNORECASE); callers upper() the codes.
+_FROM_TO_ROUTE_RE = re.compile(r"from\s+([a-z]{3})\s+to\s+([a-z]{3})")
+_PAREN_ROUTE_RE = re.compile(r"\(([A-Z]{3})\)\s*.*?\(([A-Z]{3})\)")
+_PAREN_IATA_TAIL_RE = re.compile(r"\(([A-Z]{3})\)\s*$")
+
+
+# Travel-history rollups are reused for a short while per user. Keyed on the memory
+# version, which booking writes bump, so a new booking shows up immediately.
+TRAVEL_STATS_CACHE_TTL = 30
+TRAVEL_STATS_CACHE_MAXSIZE = 1024
+
+# (kind, user_id, limit) -> (built_at, memory version, result)
+_travel_stats_cache: OrderedDict[tuple[str, str, int], tuple[float, int, list[dict]]] = OrderedDict()
+
+
+async def _cached_travel_stats(kind: str, compute, user_id: str, limit: int) -> list[dict]:
+    key = (kind, user_id, limit)
+    version = memory_manager.get_preferences_version(user_id)
+    now = time.monotonic()
+    cached = _travel_stats_cache.get(key)
+    if cached and now - cached[0] < TRAVEL_STATS_CACHE_TTL and cached[1] == version:
+        return cached[2]
+
+    result = await compute(user_id, limit)
+    _travel_stats_cache[key] = (now, version, result)
+    _travel_stats_cache.move_to_end(key)
+    while len(_travel_stats_cache) > TRAVEL_STATS_CACHE_MAXSIZE:
+        _travel_stats_cache.popitem(last=False)
+    return result
+
+
+# The raw bookings / mem0 travel history behind those rollups and the history
+# view, shared for a few seconds so a cold countries + routes pair (or a quick
+# follow-up) doesn't re-read the same rows. Same version check as above.
+TRAVEL_SOURCE_CACHE_TTL = 5
+
+# (source, user_id) -> (loaded_at, memory version, rows)
+_travel_source_cache: OrderedDict[tuple[str, str], tuple[float, int, list]] = OrderedDict()
+
+
+async def _cached_travel_source(source: str, load: Callable[[str], Optional[list]], user_id: str) -> list:
+    key = (source, user_id)
+    version = memory_manager.get_preferences_version(user_id)
+    now = time.monotonic()
+    cached = _travel_source_cache.get(key)
+    if cached and now - cached[0] < TRAVEL_SOURCE_CACHE_TTL and cached[1] == version:
+        return cached[2]
+
+    # DB / mem0 reads are blocking; keep them off the event loop.
+    rows = await asyncio.to_thread(load, user_id) or []
+    _travel_source_cache[key] = (now, version, rows)
+    _travel_source_cache.move_to_end(key)
+    while len(_travel_source_cache) > TRAVEL_STATS_CACHE_MAXSIZE:
+        _travel_source_cache.popitem(last=False)
+    return rows
+
+
+async def _list_bookings(user_id: str) -> list:
+    return await _cached_travel_source("bookings", db_storage.list_bookings, user_id)
+
+
+async def _list_travel_history(user_id: str) -> list:
+    return await _cached_travel_source("history", memory_manager.get_travel_history, user_id)
+
+
+async def _compute_most_travelled_countries(user_id: str, limit: int = 3) -> list[dict]:
+    """Most traveled destination countries, briefly cached per user."""
+    return await _cached_travel_stats("countries", _scan_most_travelled_countries, user_id, limit)
+
+
+async def _compute_frequent_routes(user_id: str, limit: int = 5) -> list[dict]:
+    """Frequent routes, briefly cached per user."""
+    return await _cached_travel_stats("routes", _scan_frequent_routes, user_id, limit)
+
+
+async def _scan_most_travelled_countries(user_id: str, limit: int = 3) -> list[dict]:
     """Compute most traveled destination countries from travel history.
 
     Prefers DB bookings; falls back to parsing mem0 travel history.
@@ -64,32 +168,37 @@ def _compute_most_travelled_countries(user_id: str, limit: int = 3) -> list[dict
         v = value.strip().upper()
         return v if len(v) == 3 else None
 
+    async def count_countries(dest_counts: Counter[str]) -> Counter[str]:
+        # Resolve each distinct destination once, concurrently, then aggregate.
+        codes = list(dest_counts)
+        countries = await asyncio.gather(*(_iata_country(c) for c in codes))
+        by_country: Counter[str] = Counter()
+        for code, country in zip(codes, countries):
+            if country:
+                by_country[country] += dest_counts[code]
+        return by_country
+
     counter: Counter[str] = Counter()
 
     # 1) DB bookings (deterministic)
     try:
-        bookings = db_storage.list_bookings(user_id)
-        for b in bookings:
-            dest = norm_iata(b.get("destination"))
-            if dest:
-                country = _iata_country(dest)
-                if country:
-                    counter[country] += 1
+        bookings = await _list_bookings(user_id)
+        dests = (norm_iata(b.get("destination")) for b in bookings)
+        dest_counts: Counter[str] = Counter(d for d in dests if d)
+        counter = await count_countries(dest_counts)
     except Exception as e:
         print(f"[AGENT] Failed to load bookings for countries: {e}")
 
     # 2) Fallback: mem0 travel history
     if not counter:
         try:
-            memories = memory_manager.get_travel_history(user_id) or []
+            memories = await _list_travel_history(user_id)
+            dest_counts = Counter()
 
             def add_destination_iata(dest_code: str | None):
                 d = norm_iata(dest_code)
-                if not d:
-                    return
-                country = _iata_country(d)
-                if country:
-                    counter[country] += 1
+                if d:
+                    dest_counts[d] += 1
 
             for m in memories:
                 if not m:
@@ -106,30 +215,29 @@ def _compute_most_travelled_countries(user_id: str, limit: int = 3) -> list[dict
                 if not memory_text:
                     continue
 
-                # Pattern: "IAH → KTM" or "IAH->KTM" (destination is second code)
-                arrow = re.findall(r"\b([A-Z]{3})\b\s*(?:→|->)\s*\b([A-Z]{3})\b", memory_text)
-                for _o, d in arrow:
-                    add_destination_iata(d)
+                # Pattern: "IAH → KTM" or "IAH->KTM" (destination is second code,
+                # already three uppercase letters)
+                dest_counts.update(d for _o, d in _ARROW_ROUTE_RE.findall(memory_text))
 
-                # Pattern: "from IAH to KTM"
-                from_to = re.findall(r"from\s+([A-Z]{3})\s+to\s+([A-Z]{3})", memory_text, flags=re.IGNORECASE)
-                for _o, d in from_to:
-                    add_destination_iata(d)
+                # Pattern: "from IAH to KTM" (matched case-insensitively, so uppercase it)
+                dest_counts.update(d.upper() for _o, d in _FROM_TO_ROUTE_RE.findall(memory_text.lower()))
 
+            counter = await count_countries(dest_counts)
         except Exception as e:
             print(f"[AGENT] Failed to compute countries from memories: {e}")
 
     if not counter:
         return []
 
-    ranked = sorted(counter.items(), key=lambda kv: (-kv[1], kv[0]))
+    # Highest count first, ties alphabetical; only the top `limit` are ordered.
+    ranked = heapq.nsmallest(max(1, limit), counter.items(), key=lambda kv: (-kv[1], kv[0]))
     out: list[dict] = []
-    for country, count in ranked[: max(1, limit)]:
+    for country, count in ranked:
         out.append({"country": country, "count": count})
     return out
 
 
-def _compute_frequent_routes(user_id: str, limit: int = 5) -> list[dict]:
+async def _scan_frequent_routes(user_id: str, limit: int = 5) -> list[dict]:
     """Compute frequent routes from travel history.
 
     Prefers DB bookings (deterministic). If none exist, falls back to mem0-based
@@ -146,7 +254,7 @@ def _compute_frequent_routes(user_id: str, limit: int = 5) -> list[dict]:
 
     # 1) DB bookings
     try:
-        bookings = db_storage.list_bookings(user_id)
+        bookings = await _list_bookings(user_id)
         for b in bookings:
             o = norm_iata(b.get("origin"))
             d = norm_iata(b.get("destination"))
@@ -163,7 +271,7 @@ def _compute_frequent_routes(user_id: str, limit: int = 5) -> list[dict]:
     # 2) Fallback: mem0 travel history
     if not counter:
         try:
-            memories = memory_manager.get_travel_history(user_id) or []
+            memories = await _list_travel_history(user_id)
 
             def add_route_pair(o: str | None, d: str | None):
                 oo = norm_iata(o)
@@ -187,20 +295,18 @@ def _compute_frequent_routes(user_id: str, limit: int = 5) -> list[dict]:
                 if not memory_text:
                     continue
 
+                # The arrow/paren patterns only match three uppercase letters,
+                # so their (origin, destination) tuples are already canonical.
                 # Pattern: "IAH → KTM" or "IAH->KTM"
-                arrow = re.findall(r"\b([A-Z]{3})\b\s*(?:→|->)\s*\b([A-Z]{3})\b", memory_text)
-                for o, d in arrow:
-                    add_route_pair(o, d)
+                counter.update(_ARROW_ROUTE_RE.findall(memory_text))
 
                 # Pattern: "from Houston (IAH) to Kathmandu (KTM)"
-                paren = re.findall(r"\(([A-Z]{3})\)\s*.*?\(([A-Z]{3})\)", memory_text)
-                for o, d in paren:
-                    add_route_pair(o, d)
+                counter.update(_PAREN_ROUTE_RE.findall(memory_text))
 
-                # Pattern: "from IAH to KTM"
-                from_to = re.findall(r"from\s+([A-Z]{3})\s+to\s+([A-Z]{3})", memory_text, flags=re.IGNORECASE)
-                for o, d in from_to:
-                    add_route_pair(o, d)
+                # Pattern: "from IAH to KTM" (matched case-insensitively, so uppercase it)
+                counter.update(
+                    (o.upper(), d.upper()) for o, d in _FROM_TO_ROUTE_RE.findall(memory_text.lower())
+                )
 
         except Exception as e:
             print(f"[AGENT] Failed to compute frequent routes from memories: {e}")
@@ -208,33 +314,62 @@ def _compute_frequent_routes(user_id: str, limit: int = 5) -> list[dict]:
     if not counter:
         return []
 
-    ranked = sorted(counter.items(), key=lambda kv: (-kv[1], kv[0]))
+    # Highest count first, ties by route; only the top `limit` are ordered.
+    top = heapq.nsmallest(max(1, limit), counter.items(), key=lambda kv: (-kv[1], kv[0]))
+    # Routes share airports; resolve each distinct code once, concurrently.
+    codes = list(dict.fromkeys(code for route, _ in top for code in route))
+    display = dict(zip(codes, await asyncio.gather(*(_iata_display(c) for c in codes))))
     out: list[dict] = []
-    for (o, d), count in ranked[: max(1, limit)]:
+    for (o, d), count in top:
         out.append({
-            "route": f"{_iata_display(o)} → {_iata_display(d)}",
+            "route": f"{display[o]} → {display[d]}",
             "count": count,
         })
     return out
 
 
-def _get_travel_history_items(user_id: str, limit: int = 50) -> list[dict]:
+# Booking text fields that go through _clean_text before display.
+_BOOKING_TEXT_FIELDS = (
+    "origin",
+    "destination",
+    "airline",
+    "airline_code",
+    "airline_name",
+    "tripType",
+    "departure_date",
+    "departure_time",
+    "arrival_time",
+    "return_origin",
+    "return_destination",
+    "return_date",
+    "return_departure_time",
+    "return_arrival_time",
+    "cabin_class",
+    "currency",
+)
+# Stray articles that sometimes land in extracted booking fields.
+_ARTICLE_WORDS = frozenset({"a", "an", "the"})
+
+
+def _clean_text(value: object) -> Optional[str]:
+    if not isinstance(value, str):
+        return None
+    v = value.strip()
+    if not v:
+        return None
+    if v.lower() in _ARTICLE_WORDS:
+        return None
+    return v
+
+
+async def _get_travel_history_items(user_id: str, limit: int = 50) -> list[dict]:
     """Return travel history items in the same shape the UI expects.
 
     Uses DB bookings first (deterministic), and falls back to mem0 travel history.
     """
-    def _clean_text(value: object) -> Optional[str]:
-        if not isinstance(value, str):
-            return None
-        v = value.strip()
-        if not v:
-            return None
-        if v.lower() in {"a", "an", "the"}:
-            return None
-        return v
-
+    limit = max(1, limit)
     try:
-        rows = db_storage.list_bookings(user_id)
+        rows = await _list_bookings(user_id)
         if rows:
             cleaned_rows: list[dict] = []
             seen_db: set[tuple] = set()
@@ -242,26 +377,9 @@ def _get_travel_history_items(user_id: str, limit: int = 50) -> list[dict]:
                 if not isinstance(r, dict):
                     continue
                 cleaned = dict(r)
-                for k in [
-                    "origin",
-                    "destination",
-                    "airline",
-                    "airline_code",
-                    "airline_name",
-                    "tripType",
-                    "departure_date",
-                    "departure_time",
-                    "arrival_time",
-                    "return_origin",
-                    "return_destination",
-                    "return_date",
-                    "return_departure_time",
-                    "return_arrival_time",
-                    "cabin_class",
-                    "currency",
-                ]:
+                for k in _BOOKING_TEXT_FIELDS:
                     if k in cleaned:
-                        cleaned[k] = _clean_text(cleaned.get(k))
+                        cleaned[k] = _clean_text(cleaned[k])
                 db_key = (
                     (cleaned.get("origin") or "").upper(),
                     (cleaned.get("destination") or "").upper(),
@@ -274,18 +392,22 @@ def _get_travel_history_items(user_id: str, limit: int = 50) -> list[dict]:
                     str(cleaned.get("price") or ""),
                     cleaned.get("tripType") or "",
                 )
-                if any(v for v in db_key) and db_key in seen_db:
-                    continue
-                if any(v for v in db_key):
+                if any(db_key):
+                    if db_key in seen_db:
+                        continue
                     seen_db.add(db_key)
                 cleaned_rows.append(cleaned)
-            return cleaned_rows[: max(1, limit)]
+                if len(cleaned_rows) >= limit:
+                    break
+            return cleaned_rows
     except Exception as e:
         print(f"[AGENT] Failed to load bookings from DB: {e}")
 
     # Fallback: mem0-based travel history
-    memories = memory_manager.get_travel_history(user_id) or []
+    memories = await _list_travel_history(user_id)
     items: list[dict] = []
+    # De-duplicate as we go (mem0 can return near-duplicates)
+    seen: set[tuple] = set()
     for m in memories:
         if not m:
             continue
@@ -297,16 +419,9 @@ def _get_travel_history_items(user_id: str, limit: int = 50) -> list[dict]:
             memory_str = str(m).strip()
             meta = {}
 
-        # Keep only booking-like entries
+        # Keep only booking-like entries ("book" also covers "booked"/"book with")
         lower = memory_str.lower()
-        if "searched" in lower:
-            continue
-        if not (
-            "book" in lower
-            or "booked" in lower
-            or "book with" in lower
-            or re.search(r"\b[A-Z]{3}\b\s*(?:→|->)\s*\b[A-Z]{3}\b", memory_str)
-        ):
+        if "searched" in lower or ("book" not in lower and not _ARROW_ROUTE_RE.search(memory_str)):
             continue
 
         item = {
@@ -330,38 +445,54 @@ def _get_travel_history_items(user_id: str, limit: int = 50) -> list[dict]:
             "booked_at": _clean_text(meta.get("booked_at")),
             "memory": memory_str,
         }
-        items.append(item)
-
-        if len(items) >= max(1, limit):
-            break
 
-    # De-duplicate (mem0 can return near-duplicates)
-    deduped: list[dict] = []
-    seen: set[tuple] = set()
-    for it in items:
-        memory_key = re.sub(r"\s+", " ", (it.get("memory") or "").strip().lower())
         fields_key = (
-            (it.get("origin") or "").upper(),
-            (it.get("destination") or "").upper(),
-            it.get("departure_date") or "",
-            it.get("return_date") or "",
-            (it.get("airline_name") or it.get("airline") or ""),
-            it.get("cabin_class") or "",
-            str(it.get("price") or ""),
-            it.get("tripType") or "",
+            (item["origin"] or "").upper(),
+            (item["destination"] or "").upper(),
+            item["departure_date"] or "",
+            item["return_date"] or "",
+            item["airline_name"] or item["airline"] or "",
+            item["cabin_class"] or "",
+            str(item["price"] or ""),
+            item["tripType"] or "",
         )
         # If we have any structured signal, dedupe primarily on that; otherwise fallback to memory text.
-        key = fields_key if any(v for v in fields_key) else (memory_key,)
+        key = fields_key if any(fields_key) else (" ".join(lower.split()),)
         if key in seen:
             continue
         seen.add(key)
-        deduped.append(it)
-    return deduped
+        items.append(item)
 
+        if len(items) >= limit:
+            break
 
-def _recommendations_from_history(user_id: str, *, solo: bool) -> str:
+    return items
+
+
+# Very small heuristic mapping (keep it minimal and safe). Buckets are emitted
+# in this order; _SUGGESTION_BUCKET_BY_CODE maps a destination IATA to its bucket.
+_SUGGESTION_BUCKETS: tuple[tuple[str, ...], ...] = (
+    (
+        "Kyoto, Japan — easy to explore solo with temples, cafés, and great transit",
+        "Osaka, Japan — food-forward city with lively neighborhoods",
+        "Seoul, South Korea — safe, efficient, and great for solo itineraries",
+    ),
+    (
+        "Pokhara, Nepal — relaxed lakeside base and great for day hikes",
+        "Paro/Thimphu, Bhutan — culture + mountains (permit-based, but very solo-friendly)",
+    ),
+)
+_SUGGESTION_BUCKET_BY_CODE: dict[str, int] = {"NRT": 0, "HND": 0, "KIX": 0, "KTM": 1}
+_DEFAULT_SUGGESTIONS: tuple[str, ...] = (
+    "Singapore — very safe, great public transit, easy for solo travelers",
+    "Lisbon, Portugal — walkable, friendly, lots of day trips",
+    "Reykjavík, Iceland — easy tours and nature with strong solo-travel infrastructure",
+)
+
+
+async def _recommendations_from_history(user_id: str, *, solo: bool) -> str:
     """Generate lightweight trip recommendations grounded in travel history."""
-    routes = _compute_frequent_routes(user_id, limit=5)
+    routes = await _compute_frequent_routes(user_id, limit=5)
     if not routes:
         return (
             "I don't see any prior bookings yet, so I can't personalize recommendations from your travel history. "
@@ -376,32 +507,19 @@ def _recommendations_from_history(user_id: str, *, solo: bool) -> str:
         parts = [p.strip() for p in route_text.split("→")]
         if len(parts) == 2:
             dest_names.append(parts[1])
-            m = re.search(r"\(([A-Z]{3})\)\s*$", parts[1])
+            m = _PAREN_IATA_TAIL_RE.search(parts[1])
             if m:
                 dest_codes.append(m.group(1))
 
     top_places = ", ".join(dest_names[:2]) if dest_names else "your recent trips"
 
-    # Very small heuristic mapping (keep it minimal and safe)
+    buckets = {_SUGGESTION_BUCKET_BY_CODE[c] for c in dest_codes if c in _SUGGESTION_BUCKET_BY_CODE}
     suggestions: list[str] = []
-    if any(c in {"NRT", "HND", "KIX"} for c in dest_codes):
-        suggestions.extend([
-            "Kyoto, Japan — easy to explore solo with temples, cafés, and great transit",
-            "Osaka, Japan — food-forward city with lively neighborhoods",
-            "Seoul, South Korea — safe, efficient, and great for solo itineraries",
-        ])
-    if any(c in {"KTM"} for c in dest_codes):
-        suggestions.extend([
-            "Pokhara, Nepal — relaxed lakeside base and great for day hikes",
-            "Paro/Thimphu, Bhutan — culture + mountains (permit-based, but very solo-friendly)",
-        ])
+    for i in sorted(buckets):
+        suggestions.extend(_SUGGESTION_BUCKETS[i])
 
     if not suggestions:
-        suggestions = [
-            "Singapore — very safe, great public transit, easy for solo travelers",
-            "Lisbon, Portugal — walkable, friendly, lots of day trips",
-            "Reykjavík, Iceland — easy tours and nature with strong solo-travel infrastructure",
-        ]
+        suggestions = list(_DEFAULT_SUGGESTIONS)
 
     # Keep response concise; user asked for recommendations, not a history dump.
     lines = [
@@ -417,7 +535,26 @@ def _recommendations_from_history(user_id: str, *, solo: bool) -> str:
     lines.append("\nTell me: do you want culture, nature, or food-focused?")
     return "\n".join(lines)
 
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# HTTP/2 lets concurrent completions (and the streamed reply) share one TLS
+# connection; DefaultAsyncHttpxClient keeps the SDK's timeout and pool defaults.
+client = AsyncOpenAI(
+    api_key=os.environ.get("OPENAI_API_KEY"),
+    http_client=DefaultAsyncHttpxClient(http2=True),
+)
+
+
+# Structured memory types in priority order, each with the substrings that select it.
+_MEMORY_TYPE_KEYWORDS = (
+    ("red_eye", ("red eye", "red-eye", "redeye")),
+    ("flight_type", ("non-stop", "nonstop", "direct", "layover", "stops")),
+    ("cabin_class", ("cabin", "class", "economy", "premium", "business", "first")),
+    ("departure_time", ("morning", "afternoon", "evening", "departure")),
+    ("seat", ("window", "aisle", "seat")),
+    ("baggage", ("baggage", "luggage", "carry-on", "checked")),
+    ("airline", ("airline", "carrier")),
+    ("passenger", ("traveling alone", "travelling alone", "solo", "with family", "kids", "children", "with partner", "spouse")),
+    ("trip_type", ("one-way", "one way", "round trip", "round-trip")),
+)
 
 
 def _infer_preference_memory_type(preference_text: str) -> str | None:
@@ -428,31 +565,158 @@ def _infer_preference_memory_type(preference_text: str) -> str | None:
     if not t:
         return None
 
-    if "red eye" in t or "red-eye" in t or "redeye" in t:
-        return "red_eye"
-    if "non-stop" in t or "nonstop" in t or "direct" in t or "layover" in t or "stops" in t:
-        return "flight_type"
-    if "cabin" in t or "class" in t or any(k in t for k in ["economy", "premium", "business", "first"]):
-        return "cabin_class"
-    if "morning" in t or "afternoon" in t or "evening" in t or "departure" in t:
-        return "departure_time"
-    if "window" in t or "aisle" in t or "seat" in t:
-        return "seat"
-    if "baggage" in t or "luggage" in t or "carry-on" in t or "checked" in t:
-        return "baggage"
-    if "airline" in t or "carrier" in t:
-        return "airline"
-    if any(k in t for k in ["traveling alone", "travelling alone", "solo", "with family", "kids", "children", "with partner", "spouse"]):
-        return "passenger"
-    if "one-way" in t or "one way" in t or "round trip" in t or "round-trip" in t:
-        return "trip_type"
-
+    for memory_type, keywords in _MEMORY_TYPE_KEYWORDS:
+        if any(kw in t for kw in keywords):
+            return memory_type
     return None
 
-def extract_preferences_from_message(user_message: str) -> list[str]:
-    """Extract detailed preference statements from user messages."""
-    preferences = []
-    message_lower = user_message.lower()
+# ---------------- Preference extraction patterns ----------------
+# Compiled once at import; see extract_preferences_from_message. All of these
+# run against the lowercased message, so none need re.IGNORECASE.
+_STRONG_PERSIST_INTENT_RE = re.compile(
+    r"\b(remember|from\s+now\s+on|going\s+forward|in\s+the\s+future|set\s+(?:this|it)\s+as\s+(?:my\s+)?default|make\s+(?:this|it)\s+my\s+default|default\s+to)\b",
+)
+_SOFT_PERSIST_INTENT_RE = re.compile(
+    r"\b(prefer|like|love|usually|typically|always)\b",
+)
+_EPHEMERAL_INTENT_RE = re.compile(
+    r"\b("
+    r"choose|pick|select|"
+    r"(?:let\s+us|let's|lets)\s+(?:go\s+with|do|pick|choose)|"
+    r"go\s+with|"
+    r"should\s+work|should\s+be\s+fine|(?:that|this)\s+should\s+be\s+fine|"
+    r"(?:that|this)\s+is\s+fine|either\s+is\s+fine|any\s+is\s+fine|"
+    r"whatever\s+works|"
+    r"just\s+this\s+time|this\s+time\s+only|for\s+now|"
+    r"for\s+this\s+(?:search|trip|flight|chat|conversation|demo)|"
+    r"only\s+for\s+this\s+(?:search|trip|flight|chat|conversation|demo)"
+    r")\b",
+)
+
+# Cabin class preferences (stored only when allow_persist=True)
+_CABIN_PATTERNS = [
+    (re.compile(r"premium\s+economy"), "I prefer Premium Economy class flights"),
+    (re.compile(r"\bbusiness\b"), "I prefer Business class flights"),
+    (re.compile(r"\bfirst\b"), "I prefer First Class flights"),
+    # Economy must come after premium economy
+    (re.compile(r"\beconomy\b"), "I prefer Economy class flights"),
+]
+
+# Seat preferences
+_SEAT_PATTERNS = [
+    (re.compile(r"(?:i\s+)?(?:prefer|want|need)\s+(?:window|aisle|exit\s+row)\s+seats?"), "window/aisle/exit row"),
+    (re.compile(r"(?:no|avoid|don't\s+like|hate)\s+(?:middle|center)\s+seats?"), "avoid middle seats"),
+    (re.compile(r"(?:window|aisle|exit\s+row)\s+seats?"), "window/aisle/exit row seats"),
+]
+
+# Airline preferences
+_AIRLINE_PATTERNS = [
+    (re.compile(r"(?:i\s+)?(?:prefer|fly|love)\s+(?:with\s+)?(?:united|american|delta|southwest|jetblue|alaska|spirit|frontier|southwest)"), "preferred airline"),
+    (re.compile(r"(?:avoid|don't\s+like|hate)\s+(?:united|american|delta|southwest|jetblue|alaska|spirit|frontier)"), "avoid airline"),
+]
+
+# Time preferences
+_TIME_PATTERNS = [
+    # Avoidance should win over generic time mentions
+    (re.compile(r"(?:hate|avoid|don\s*'?t\s+like|do\s+not\s+like)\s+(?:flying\s+)?(?:in\s+the\s+)?mornings?\b"), "Avoid morning flights"),
+    (re.compile(r"(?:hate|avoid|don\s*'?t\s+like|do\s+not\s+like)\s+(?:flying\s+)?(?:in\s+the\s+)?afternoons?\b"), "Avoid afternoon flights"),
+    (re.compile(r"(?:hate|avoid|don\s*'?t\s+like|do\s+not\s+like)\s+(?:flying\s+)?(?:in\s+the\s+)?evenings?\b"), "Avoid evening flights"),
+    (re.compile(r"(?:hate|avoid|don\s*'?t\s+like|do\s+not\s+like)\s+(?:early\s+)?morning\s+flights?"), "Avoid morning flights"),
+    (re.compile(r"(?:hate|avoid|don\s*'?t\s+like|do\s+not\s+like)\s+afternoon\s+flights?"), "Avoid afternoon flights"),
+    (re.compile(r"(?:hate|avoid|don\s*'?t\s+like|do\s+not\s+like)\s+(?:late\s+)?evening\s+flights?"), "Avoid evening flights"),
+
+    # Positive preferences (capture common phrasing)
+    (re.compile(r"(?:i\s+)?(?:prefer|like|love|want)\s+(?:to\s+)?(?:fly|flying)\s+(?:in\s+the\s+)?mornings?\b"), "morning flights"),
+    (re.compile(r"(?:i\s+)?(?:prefer|like|love|want)\s+(?:to\s+)?(?:fly|flying)\s+(?:in\s+the\s+)?afternoons?\b"), "afternoon flights"),
+    (re.compile(r"(?:i\s+)?(?:prefer|like|love|want)\s+(?:to\s+)?(?:fly|flying)\s+(?:in\s+the\s+)?evenings?\b"), "evening flights"),
+    (re.compile(r"(?:early\s+)?morning\s+flights?"), "morning flights"),
+    (re.compile(r"late\s+evening\s+flights?"), "evening flights"),
+    (re.compile(r"afternoon\s+flights?"), "afternoon flights"),
+    (re.compile(r"(?:prefer|want)\s+(?:early|late|morning|afternoon|evening)\s+departures?"), "preferred departure time"),
+    (re.compile(r"\b(?:in\s+the\s+)?mornings?\b"), "morning flights"),
+]
+
+# Flight type preferences
+_FLIGHT_PATTERNS = [
+    (re.compile(r"(?:find|search\s+for|want|need)?\s*direct\s+flights?"), "direct flights"),
+    (re.compile(r"non-?stop\s+(?:only|flights|preferred)?"), "non-stop flights"),
+    (re.compile(r"(?:no|avoid)\s+layovers?"), "avoid layovers"),
+    (re.compile(r"(?:don't\s+)?(?:mind|ok\s+with)\s+(?:one|1|multiple|some)?\s*layovers?"), "willing to take layovers"),
+]
+
+# Passenger preferences
+_PASSENGER_PATTERNS = [
+    (re.compile(r"(?:i\s+)?(?:travel\s+)?(?:alone|solo)"), "traveling alone"),
+    (re.compile(r"(?:with\s+)?(?:family|kids|children)"), "traveling with family"),
+    (re.compile(r"(?:with\s+)?(?:partner|spouse|significant\s+other)"), "traveling with partner"),
+]
+
+# Baggage preferences
+_BAGGAGE_PATTERNS = [
+    (re.compile(r"(?:light\s+)?packer|minimal\s+baggage"), "light packer"),
+    (re.compile(r"(?:need|require)\s+(?:extra|checked)\s+baggage"), "extra baggage needed"),
+    (re.compile(r"cabin\s+baggage\s+only"), "carry-on only"),
+]
+
+# Budget preferences
+# IMPORTANT: Don't store "cheap" as a long-lived preference.
+# Treat budget as a preference only when the user expresses it as a stable constraint.
+_BUDGET_PATTERNS = [
+    (
+        re.compile(r"\b(on\s+a\s+budget|tight\s+budget|budget[-\s]?friendly|budget[-\s]?conscious|as\s+cheap\s+as\s+possible|cheapest\s+possible)\b"),
+        "budget conscious",
+    ),
+]
+
+# Red-eye preferences
+_RED_EYE_PATTERNS = [
+    (re.compile(r"red\s*-?eye"), "Avoid red-eye flights"),
+    (re.compile(r"redeye"), "Avoid red-eye flights"),
+    (re.compile(r"(?:hate|avoid|don\s*'?t\s+like|do\s+not\s+like)\s+.*red\s*-?eye"), "Avoid red-eye flights"),
+]
+
+# Pattern groups in match order, each guarded by literal keywords that every
+# pattern in the group requires. A cheap substring check skips whole groups
+# (and their regex scans) for messages that can't match them.
+_PREFERENCE_PATTERN_GROUPS: list[tuple[tuple[str, ...], list[tuple[re.Pattern, str]]]] = [
+    (("seat",), _SEAT_PATTERNS),
+    (("united", "american", "delta", "southwest", "jetblue", "alaska", "spirit", "frontier"), _AIRLINE_PATTERNS),
+    (("morning", "afternoon", "evening", "departure"), _TIME_PATTERNS),
+    (("direct", "stop", "layover"), _FLIGHT_PATTERNS),
+    (("alone", "solo", "family", "kids", "children", "partner", "spouse", "significant"), _PASSENGER_PATTERNS),
+    (("packer", "baggage"), _BAGGAGE_PATTERNS),
+    (("budget", "cheap"), _BUDGET_PATTERNS),
+    (("red",), _RED_EYE_PATTERNS),
+    (("economy", "business", "first"), _CABIN_PATTERNS),
+]
+# Time-of-day bucket for each avoid / positive time label. _TIME_PATTERNS lists
+# avoid patterns first, so an avoided bucket is known before its positive
+# labels are tried and those can simply be skipped.
+_TIME_AVOID_BUCKET = {
+    "Avoid morning flights": "morning",
+    "Avoid afternoon flights": "afternoon",
+    "Avoid evening flights": "evening",
+}
+_TIME_POSITIVE_BUCKET = {
+    "morning flights": "morning",
+    "afternoon flights": "afternoon",
+    "evening flights": "evening",
+}
+# Every group keyword; a message containing none of them can't yield a preference.
+_PREFERENCE_TRIGGER_KEYWORDS = tuple(dict.fromkeys(
+    kw for keywords, _ in _PREFERENCE_PATTERN_GROUPS for kw in keywords
+))
+
+
+def extract_preferences_from_message(user_message: str, message_lower: Optional[str] = None) -> list[str]:
+    """Extract detailed preference statements from user messages.
+
+    Pass `message_lower` when the caller has already lowercased the message.
+    """
+    if message_lower is None:
+        message_lower = user_message.lower()
+    if not any(kw in message_lower for kw in _PREFERENCE_TRIGGER_KEYWORDS):
+        return []
 
     # ---------------- Intent gating (IMPORTANT) ----------------
     # We only store preferences as long-lived memory when the user explicitly
@@ -460,202 +724,98 @@ def extract_preferences_from_message(user_message: str) -> list[str]:
     # If the user uses ephemeral phrasing (e.g., "choose", "should work", "for this trip only"),
     # we treat it as *current chat/search only* and do NOT return extracted preferences
     # (so the /api/chat endpoint won't persist them).
-    strong_persist_intent_re = re.compile(
-        r"\b(remember|from\s+now\s+on|going\s+forward|in\s+the\s+future|set\s+(?:this|it)\s+as\s+(?:my\s+)?default|make\s+(?:this|it)\s+my\s+default|default\s+to)\b",
-        re.IGNORECASE,
-    )
-    soft_persist_intent_re = re.compile(
-        r"\b(prefer|like|love|usually|typically|always)\b",
-        re.IGNORECASE,
-    )
-    ephemeral_intent_re = re.compile(
-        r"\b("
-        r"choose|pick|select|"
-        r"(?:let\s+us|let's|lets)\s+(?:go\s+with|do|pick|choose)|"
-        r"go\s+with|"
-        r"should\s+work|should\s+be\s+fine|(?:that|this)\s+should\s+be\s+fine|"
-        r"(?:that|this)\s+is\s+fine|either\s+is\s+fine|any\s+is\s+fine|"
-        r"whatever\s+works|"
-        r"just\s+this\s+time|this\s+time\s+only|for\s+now|"
-        r"for\s+this\s+(?:search|trip|flight|chat|conversation|demo)|"
-        r"only\s+for\s+this\s+(?:search|trip|flight|chat|conversation|demo)"
-        r")\b",
-        re.IGNORECASE,
+    allow_persist = bool(_STRONG_PERSIST_INTENT_RE.search(message_lower)) or (
+        bool(_SOFT_PERSIST_INTENT_RE.search(message_lower))
+        and not _EPHEMERAL_INTENT_RE.search(message_lower)
     )
-
-    has_strong_intent = bool(strong_persist_intent_re.search(user_message or ""))
-    has_soft_intent = bool(soft_persist_intent_re.search(user_message or ""))
-    has_ephemeral_intent = bool(ephemeral_intent_re.search(user_message or ""))
-
-    allow_persist = has_strong_intent or (has_soft_intent and not has_ephemeral_intent)
     if not allow_persist:
         return []
 
-    # Cabin class preferences (stored only when allow_persist=True)
-    cabin_patterns: list[tuple[str, str]] = [
-        (r"premium\s+economy", "I prefer Premium Economy class flights"),
-        (r"\bbusiness\b", "I prefer Business class flights"),
-        (r"\bfirst\b", "I prefer First Class flights"),
-        # Economy must come after premium economy
-        (r"\beconomy\b", "I prefer Economy class flights"),
-    ]
-    
-    # Seat preferences
-    seat_patterns = [
-        (r"(?:i\s+)?(?:prefer|want|need)\s+(?:window|aisle|exit\s+row)\s+seats?", "window/aisle/exit row"),
-        (r"(?:no|avoid|don't\s+like|hate)\s+(?:middle|center)\s+seats?", "avoid middle seats"),
-        (r"(?:window|aisle|exit\s+row)\s+seats?", "window/aisle/exit row seats"),
-    ]
-    
-    # Airline preferences
-    airline_patterns = [
-        (r"(?:i\s+)?(?:prefer|fly|love)\s+(?:with\s+)?(?:united|american|delta|southwest|jetblue|alaska|spirit|frontier|southwest)", "preferred airline"),
-        (r"(?:avoid|don't\s+like|hate)\s+(?:united|american|delta|southwest|jetblue|alaska|spirit|frontier)", "avoid airline"),
-    ]
-    
-    # Time preferences
-    time_patterns = [
-        # Avoidance should win over generic time mentions
-        (r"(?:hate|avoid|don\s*'?t\s+like|do\s+not\s+like)\s+(?:flying\s+)?(?:in\s+the\s+)?mornings?\b", "Avoid morning flights"),
-        (r"(?:hate|avoid|don\s*'?t\s+like|do\s+not\s+like)\s+(?:flying\s+)?(?:in\s+the\s+)?afternoons?\b", "Avoid afternoon flights"),
-        (r"(?:hate|avoid|don\s*'?t\s+like|do\s+not\s+like)\s+(?:flying\s+)?(?:in\s+the\s+)?evenings?\b", "Avoid evening flights"),
-        (r"(?:hate|avoid|don\s*'?t\s+like|do\s+not\s+like)\s+(?:early\s+)?morning\s+flights?", "Avoid morning flights"),
-        (r"(?:hate|avoid|don\s*'?t\s+like|do\s+not\s+like)\s+afternoon\s+flights?", "Avoid afternoon flights"),
-        (r"(?:hate|avoid|don\s*'?t\s+like|do\s+not\s+like)\s+(?:late\s+)?evening\s+flights?", "Avoid evening flights"),
-
-        # Positive preferences (capture common phrasing)
-        (r"(?:i\s+)?(?:prefer|like|love|want)\s+(?:to\s+)?(?:fly|flying)\s+(?:in\s+the\s+)?mornings?\b", "morning flights"),
-        (r"(?:i\s+)?(?:prefer|like|love|want)\s+(?:to\s+)?(?:fly|flying)\s+(?:in\s+the\s+)?afternoons?\b", "afternoon flights"),
-        (r"(?:i\s+)?(?:prefer|like|love|want)\s+(?:to\s+)?(?:fly|flying)\s+(?:in\s+the\s+)?evenings?\b", "evening flights"),
-        (r"(?:early\s+)?morning\s+flights?", "morning flights"),
-        (r"late\s+evening\s+flights?", "evening flights"),
-        (r"afternoon\s+flights?", "afternoon flights"),
-        (r"(?:prefer|want)\s+(?:early|late|morning|afternoon|evening)\s+departures?", "preferred departure time"),
-        (r"\b(?:in\s+the\s+)?mornings?\b", "morning flights"),
-    ]
-    
-    # Flight type preferences
-    flight_patterns = [
-        (r"(?:find|search\s+for|want|need)?\s*direct\s+flights?", "direct flights"),
-        (r"non-?stop\s+(?:only|flights|preferred)?", "non-stop flights"),
-        (r"(?:no|avoid)\s+layovers?", "avoid layovers"),
-        (r"(?:don't\s+)?(?:mind|ok\s+with)\s+(?:one|1|multiple|some)?\s*layovers?", "willing to take layovers"),
-    ]
-    
-    # Passenger preferences
-    passenger_patterns = [
-        (r"(?:i\s+)?(?:travel\s+)?(?:alone|solo)", "traveling alone"),
-        (r"(?:with\s+)?(?:family|kids|children)", "traveling with family"),
-        (r"(?:with\s+)?(?:partner|spouse|significant\s+other)", "traveling with partner"),
-    ]
-    
-    # Baggage preferences
-    baggage_patterns = [
-        (r"(?:light\s+)?packer|minimal\s+baggage", "light packer"),
-        (r"(?:need|require)\s+(?:extra|checked)\s+baggage", "extra baggage needed"),
-        (r"cabin\s+baggage\s+only", "carry-on only"),
-    ]
-    
-    # Budget preferences
-    # IMPORTANT: Don't store "cheap" as a long-lived preference.
-    # Treat budget as a preference only when the user expresses it as a stable constraint.
-    budget_patterns = [
-        (
-            r"\b(on\s+a\s+budget|tight\s+budget|budget[-\s]?friendly|budget[-\s]?conscious|as\s+cheap\s+as\s+possible|cheapest\s+possible)\b",
-            "budget conscious",
-        ),
-    ]
-
-    # Red-eye preferences
-    red_eye_patterns = [
-        (r"red\s*-?eye", "Avoid red-eye flights"),
-        (r"redeye", "Avoid red-eye flights"),
-        (r"(?:hate|avoid|don\s*'?t\s+like|do\s+not\s+like)\s+.*red\s*-?eye", "Avoid red-eye flights"),
-    ]
-    
-    # Location/home preferences
-    location_patterns = [
-        (r"(?:i\s+)?(?:live|based|from)\s+(?:in\s+)?(\w+)", "home city preference"),
-    ]
-    
-    all_patterns = [
-        seat_patterns, airline_patterns, time_patterns, 
-        flight_patterns, passenger_patterns, baggage_patterns, budget_patterns, red_eye_patterns,
-        cabin_patterns,
-    ]
-    
-    for pattern_group in all_patterns:
-        for pattern, label in pattern_group:
-            if re.search(pattern, message_lower):
-                preferences.append(label)
-    
-    # Remove duplicates while preserving order
-    seen = set()
-    unique_prefs = []
-    for pref in preferences:
-        if pref not in seen:
-            seen.add(pref)
-            unique_prefs.append(pref)
-
-    # Resolve contradictions: if the user expresses avoidance for a time bucket,
-    # don't also store the positive version (which can overwrite the avoid entry
-    # for mutually-exclusive DB types).
+    # Remove duplicates while preserving order (dict keys).
+    #
+    # Resolve contradictions as we go: if the user expresses avoidance for a
+    # time bucket, don't also store the positive version (which can overwrite
+    # the avoid entry for mutually-exclusive DB types). The generic time label
+    # is dropped too, since any avoid match names its bucket in the message.
+    prefs: dict[str, None] = {}
     avoid_buckets: set[str] = set()
-    for pref in unique_prefs:
-        pl = pref.lower()
-        if pl.startswith("avoid "):
-            for b in ("morning", "afternoon", "evening"):
-                if b in pl:
-                    avoid_buckets.add(b)
-
-    if avoid_buckets:
-        filtered: list[str] = []
-        for pref in unique_prefs:
-            pl = pref.lower()
-            # Drop positive time labels that conflict with avoidance.
-            if pl in {"morning flights", "afternoon flights", "evening flights"}:
-                for b in avoid_buckets:
-                    if b in pl:
-                        break
-                else:
-                    filtered.append(pref)
+    for keywords, patterns in _PREFERENCE_PATTERN_GROUPS:
+        if not any(kw in message_lower for kw in keywords):
+            continue
+        for pattern, label in patterns:
+            if avoid_buckets and (
+                _TIME_POSITIVE_BUCKET.get(label) in avoid_buckets
+                or label == "preferred departure time"
+            ):
                 continue
-            # Also drop the generic time label if it's for an avoided bucket.
-            if pl == "preferred departure time" and any(b in (user_message or "").lower() for b in avoid_buckets):
+            if not pattern.search(message_lower):
                 continue
-            filtered.append(pref)
-        unique_prefs = filtered
-    
-    return unique_prefs
+            prefs[label] = None
+            bucket = _TIME_AVOID_BUCKET.get(label)
+            if bucket:
+                avoid_buckets.add(bucket)
+
+    return list(prefs)
+
+
+# "cheap flights" should steer the current search, but "budget conscious" is only
+# persisted when the user states it as a stable constraint.
+_STABLE_BUDGET_RE = re.compile(
+    r"\b(on\s+a\s+budget|tight\s+budget|budget[-\s]?friendly|budget[-\s]?conscious|as\s+cheap\s+as\s+possible|cheapest\s+possible)\b"
+)
+
+
+def persistable_preferences(prefs: Optional[list], message_lower: str) -> list[str]:
+    """Filter extracted preferences down to the ones worth storing long-term."""
+    kept: list[str] = []
+    for pref in prefs or []:
+        if not isinstance(pref, str) or not pref.strip():
+            continue
+        if pref.strip().lower() == "budget conscious" and not _STABLE_BUDGET_RE.search(message_lower):
+            continue
+        kept.append(pref)
+    return kept
 
 
-def _augment_current_preferences_from_message(current_preferences: Optional[dict], user_message: str) -> dict:
+# In-message cabin / red-eye / direct cues for the current search. Each regex is
+# only run once a cheap substring test shows it could match.
+_FIRST_WORD_RE = re.compile(r"\bfirst\b")
+_BUSINESS_WORD_RE = re.compile(r"\bbusiness\b")
+_ECONOMY_WORD_RE = re.compile(r"\beconomy\b")
+_RED_EYE_RE = re.compile(r"red\s*-?eye|redeye")
+_RED_EYE_AVOID_RE = re.compile(r"hate|avoid|don't\s+like|do\s+not\s+like|no\s+red")
+_DIRECT_RE = re.compile(r"\bdirect\b|non\s*-?stop")
+_DIRECT_INTENT_WORDS = ("only", "prefer", "please", "want", "need")
+
+
+def _augment_current_preferences_from_message(current_preferences: Optional[dict], user_message: str, message_lower: Optional[str] = None) -> dict:
     """Best-effort: turn free-form messages like 'economy please' into current prefs.
 
     This affects the *current* search immediately even if the user didn't open the UI dropdown.
+    Pass `message_lower` when the caller has already lowercased the message.
     """
     merged = dict(current_preferences or {})
     if not isinstance(user_message, str):
         return merged
 
-    t = user_message.lower()
+    t = user_message.lower() if message_lower is None else message_lower
 
     # Cabin class
     if "premium" in t and "economy" in t:
         merged["cabinClass"] = "Premium Economy"
-    elif re.search(r"\bfirst\b", t):
+    elif "first" in t and _FIRST_WORD_RE.search(t):
         merged["cabinClass"] = "First Class"
-    elif re.search(r"\bbusiness\b", t):
+    elif "business" in t and _BUSINESS_WORD_RE.search(t):
         merged["cabinClass"] = "Business"
-    elif re.search(r"\beconomy\b", t):
+    elif "economy" in t and _ECONOMY_WORD_RE.search(t):
         merged["cabinClass"] = "Economy"
 
     # Red-eye avoidance
-    if re.search(r"red\s*-?eye|redeye", t) and re.search(r"hate|avoid|don't\s+like|do\s+not\s+like|no\s+red", t):
+    if "eye" in t and _RED_EYE_RE.search(t) and _RED_EYE_AVOID_RE.search(t):
         merged["avoidRedEye"] = True
 
     # Direct flights
-    if re.search(r"\bdirect\b|non\s*-?stop", t) and re.search(r"only|prefer|please|want|need", t):
+    if ("direct" in t or "stop" in t) and _DIRECT_RE.search(t) and any(w in t for w in _DIRECT_INTENT_WORDS):
         merged["directFlightsOnly"] = True
 
     return merged
@@ -790,81 +950,251 @@ Today's date is {today}.
 When you successfully search for flights, format your response to be clear and helpful. ALWAYS mention any stored preferences you're applying to the search.
 """
 
-def get_system_prompt_with_memory(user_id: str) -> str:
-    """Get system prompt enriched with user memories at conversation start."""
-    base_prompt = SYSTEM_PROMPT.format(today=datetime.now().strftime("%Y-%m-%d"))
+# Split once so building the prompt is a plain concatenation rather than str.format.
+_SYSTEM_PROMPT_HEAD, _SYSTEM_PROMPT_TAIL = SYSTEM_PROMPT.split("{today}")
+
+# Section headings for the stored-preferences block in the memory prompt.
+_CATEGORY_DISPLAY_PROMPT = {
+    "seat_preferences": "🪑 Seat Preferences",
+    "airline_preferences": "✈️ Preferred Airlines",
+    "time_preferences": "🕐 Time Preferences",
+    "flight_type_preferences": "🛫 Flight Type",
+    "cabin_class_preferences": "🎫 Cabin Class",
+    "red_eye_preferences": "🌙 Red-Eye Preferences",
+    "passenger_preferences": "👥 Number of Passengers",
+    "baggage_preferences": "🎒 Baggage",
+    "routes": "🗺️ Favorite Routes",
+    "budget_info": "💰 Budget",
+    "location": "📍 Home Location",
+    "other_preferences": "📋 Other"
+}
+
+# Section headings for the "what are my preferences" reply (memory_type keys).
+_CATEGORY_DISPLAY_REPLY = {
+    "seat": "🪑 Seat Preferences",
+    "airline": "✈️ Preferred Airlines",
+    "departure_time": "🕐 Time Preferences",
+    "flight_type": "🛫 Flight Type",
+    "cabin_class": "🎫 Cabin Class",
+    "red_eye": "🌙 Red-Eye Preferences",
+    "passenger": "👥 Passenger Type",
+    "baggage": "🎒 Baggage",
+    "routes": "🗺️ Favorite Routes",
+    "budget": "💰 Budget",
+    "trip_type": "✈️ Trip Type",
+    "location": "📍 Home Location",
+    "other": "📋 Other"
+}
+
+_GREETINGS = (
+    "Hey {username}! 👋 I'm excited to help you find the perfect flights!",
+    "Welcome, {username}! Ready to start your travel adventure?",
+    "Hi {username}! Let's find some amazing flights for you.",
+    "Great to see you, {username}! How can I help with your travel plans?",
+)
+
+
+_today_cache: list = [None, ""]  # [date, "YYYY-MM-DD"]
+
+
+def _today_str() -> str:
+    """Today's date as YYYY-MM-DD, formatted once per calendar day."""
+    today = date.today()
+    if _today_cache[0] != today:
+        _today_cache[0], _today_cache[1] = today, today.isoformat()
+    return _today_cache[1]
+
+
+_system_prompt_cache: list = ["", ""]  # [date string, assembled prompt]
+
+
+def get_system_prompt(today: Optional[str] = None) -> str:
+    """Get the user-independent system prompt (kept identical across users for OpenAI prompt caching)."""
+    today = today or _today_str()
+    if _system_prompt_cache[0] != today:
+        _system_prompt_cache[0], _system_prompt_cache[1] = today, f"{_SYSTEM_PROMPT_HEAD}{today}{_SYSTEM_PROMPT_TAIL}"
+    return _system_prompt_cache[1]
+
+
+# Upper bound on memory-prompt reuse. Version bumps cover writes made through this
+# process; the TTL picks up memories mem0 ingests asynchronously or other workers write.
+MEMORY_PROMPT_CACHE_TTL = 60
+MEMORY_PROMPT_CACHE_MAXSIZE = 10_000
+
+# user_id -> (built_at, preferences version, memory prompt), least recently built first
+_memory_prompt_cache: OrderedDict[str, tuple[float, int, str]] = OrderedDict()
+# user_id -> (built_at, preferences version, summarize_preferences result); same bounds
+_prefs_summary_cache: OrderedDict[str, tuple[float, int, dict]] = OrderedDict()
+# Both caches above are filled from worker threads (get_memory_prompt and
+# get_preference_overrides run under asyncio.to_thread), so every read and
+# update goes through this lock. The mem0 calls themselves run outside it.
+_prefs_cache_lock = threading.Lock()
+
+
+def _load_preferences_summary(user_id: str) -> dict:
+    """summarize_preferences, reused across messages until the preferences version changes."""
+    version = memory_manager.get_preferences_version(user_id)
+    now = time.monotonic()
+    with _prefs_cache_lock:
+        cached = _prefs_summary_cache.get(user_id)
+    if cached and now - cached[0] < MEMORY_PROMPT_CACHE_TTL and cached[1] == version:
+        return cached[2]
+
+    summary = memory_manager.summarize_preferences(user_id)
+    # summarize_preferences returns {} on mem0 errors; don't pin that for a whole TTL.
+    if summary:
+        with _prefs_cache_lock:
+            _prefs_summary_cache[user_id] = (now, version, summary)
+            _prefs_summary_cache.move_to_end(user_id)
+            while len(_prefs_summary_cache) > MEMORY_PROMPT_CACHE_MAXSIZE:
+                _prefs_summary_cache.popitem(last=False)
+    return summary
+
+
+def _summarize_preferences(user_id: str, prefs_cache: Optional[dict] = None) -> dict:
+    """Cached preference summary, also memoized in `prefs_cache` for the duration of one message."""
+    if prefs_cache is None:
+        return _load_preferences_summary(user_id)
+    if user_id not in prefs_cache:
+        prefs_cache[user_id] = _load_preferences_summary(user_id)
+    return prefs_cache[user_id]
+
+
+def get_memory_prompt(user_id: str, prefs_cache: Optional[dict] = None) -> str:
+    """Stored-preferences block for a user (empty if none), cached briefly per preferences version."""
+    version = memory_manager.get_preferences_version(user_id)
+    now = time.monotonic()
+    with _prefs_cache_lock:
+        cached = _memory_prompt_cache.get(user_id)
+    if cached and now - cached[0] < MEMORY_PROMPT_CACHE_TTL and cached[1] == version:
+        return cached[2]
+
+    prompt, complete = _build_memory_prompt(user_id, prefs_cache)
+    if complete:
+        with _prefs_cache_lock:
+            _memory_prompt_cache[user_id] = (now, version, prompt)
+            _memory_prompt_cache.move_to_end(user_id)
+            while len(_memory_prompt_cache) > MEMORY_PROMPT_CACHE_MAXSIZE:
+                _memory_prompt_cache.popitem(last=False)
+    return prompt
+
+
+def _build_memory_prompt(user_id: str, prefs_cache: Optional[dict] = None) -> tuple[str, bool]:
+    parts: list[str] = []
     
     # Retrieve comprehensive user context from memories
     try:
-        user_context = memory_manager.get_user_context(user_id)
-        pref_summary = memory_manager.summarize_preferences(user_id)
-        
-        if user_context or pref_summary:
-            base_prompt += "\n\n" + "="*70
-            base_prompt += "\n📌 YOUR STORED PREFERENCES (Apply These Automatically):\n" + "="*70
+        pref_summary = _summarize_preferences(user_id, prefs_cache)
+        # Only the presence of other memories matters here (their text isn't
+        # rendered), so skip that extra mem0 read when preferences already exist.
+        if pref_summary or memory_manager.get_user_context(user_id):
+            parts.append("="*70)
+            parts.append("\n📌 YOUR STORED PREFERENCES (Apply These Automatically):\n" + "="*70)
             
             # Display preferences in a clear, categorized format
             if pref_summary:
                 for category, items in pref_summary.items():
                     if items:
-                        category_display = {
-                            "seat_preferences": "🪑 Seat Preferences",
-                            "airline_preferences": "✈️ Preferred Airlines",
-                            "time_preferences": "🕐 Time Preferences",
-                            "flight_type_preferences": "🛫 Flight Type",
-                            "cabin_class_preferences": "🎫 Cabin Class",
-                            "red_eye_preferences": "🌙 Red-Eye Preferences",
-                            "passenger_preferences": "👥 Number of Passengers",
-                            "baggage_preferences": "🎒 Baggage",
-                            "routes": "🗺️ Favorite Routes",
-                            "budget_info": "💰 Budget",
-                            "location": "📍 Home Location",
-                            "other_preferences": "📋 Other"
-                        }
-                        display_name = category_display.get(category, category.replace("_", " ").title())
-                        base_prompt += f"\n{display_name}:\n"
+                        display_name = _CATEGORY_DISPLAY_PROMPT.get(category, category.replace("_", " ").title())
+                        parts.append(f"\n{display_name}:\n")
                         for item in items:
                             if isinstance(item, dict):
                                 item_text = item.get("text", item.get("memory", str(item)))
                             else:
                                 item_text = str(item)
-                            base_prompt += f"  • {item_text}\n"
+                            parts.append(f"  • {item_text}\n")
             
-            base_prompt += "\n" + "="*70
-            base_prompt += "\n✓ USE THESE PREFERENCES AUTOMATICALLY IN ALL SEARCHES"
-            base_prompt += "\n✓ MENTION THEM WHEN APPLYING (e.g., 'Since you prefer direct flights...')"
-            base_prompt += "\n✓ CONFIRM NEW PREFERENCES IMMEDIATELY WHEN EXPRESSED"
-            base_prompt += "\n" + "="*70 + "\n"
+            parts.append("\n" + "="*70)
+            parts.append("\n✓ USE THESE PREFERENCES AUTOMATICALLY IN ALL SEARCHES")
+            parts.append("\n✓ MENTION THEM WHEN APPLYING (e.g., 'Since you prefer direct flights...')")
+            parts.append("\n✓ CONFIRM NEW PREFERENCES IMMEDIATELY WHEN EXPRESSED")
+            parts.append("\n" + "="*70 + "\n")
     except Exception as e:
         print(f"[ERROR] Error enriching prompt with memory: {e}")
+        # Don't cache a block that is missing the user's memories.
+        return "".join(parts), False
     
-    return base_prompt
+    return "".join(parts), True
+
+# Substring hints used to find the last route search in recent history.
+_ROUTE_HINT_RE = re.compile("houston|kathmandu|hyderabad|new york|iath|ktm|hyd|jfk")
+_SEARCH_HINT_RE = re.compile("search|find|flight|from|to")
+
+# Explicit flight-search requests (verbs or a from ... to ... route).
+_SEARCH_VERB_RE = re.compile(r"\b(find|search|show|book|get|look\s*up|pull\s*up)\b")
+_FROM_TO_PHRASE_RE = re.compile(r"\bfrom\b.+\bto\b")
+
+_IN_DAYS_RE = re.compile(r"in\s+(\d+)\s+days?")
+_IN_WEEKS_RE = re.compile(r"in\s+(\d+)\s+weeks?")
+
+def _days_from_today(days: int) -> str:
+    return (date.today() + timedelta(days=days)).isoformat()
 
 def parse_relative_date(date_text: str) -> Optional[str]:
     """Parse relative date expressions like 'next week', 'tomorrow', etc."""
-    today = datetime.now()
     date_text = date_text.lower().strip()
     
     if "tomorrow" in date_text:
-        return (today + timedelta(days=1)).strftime("%Y-%m-%d")
-    elif "next week" in date_text:
-        return (today + timedelta(weeks=1)).strftime("%Y-%m-%d")
-    elif "next month" in date_text:
-        return (today + timedelta(days=30)).strftime("%Y-%m-%d")
-    elif "in" in date_text and "days" in date_text:
-        match = re.search(r"in\s+(\d+)\s+days?", date_text)
-        if match:
-            days = int(match.group(1))
-            return (today + timedelta(days=days)).strftime("%Y-%m-%d")
-    elif "in" in date_text and "week" in date_text:
-        match = re.search(r"in\s+(\d+)\s+weeks?", date_text)
-        if match:
-            weeks = int(match.group(1))
-            return (today + timedelta(weeks=weeks)).strftime("%Y-%m-%d")
+        return _days_from_today(1)
+    if "next week" in date_text:
+        return _days_from_today(7)
+    if "next month" in date_text:
+        return _days_from_today(30)
+    if "in" not in date_text:
+        return None
+    if "days" in date_text:
+        match = _IN_DAYS_RE.search(date_text)
+        return _days_from_today(int(match.group(1))) if match else None
+    if "week" in date_text:
+        match = _IN_WEEKS_RE.search(date_text)
+        return _days_from_today(7 * int(match.group(1))) if match else None
     
     return None
 
-def get_preference_overrides(user_id: str, current_preferences: Optional[dict] = None) -> dict:
+# (required keywords, value, label) rows checked in order; the first row whose
+# keywords all appear in the lowered text wins.
+_CURRENT_CABIN_RULES = (
+    (("first",), "FIRST", "First Class (current selection)"),
+    (("business",), "BUSINESS", "Business Class (current selection)"),
+    (("premium",), "PREMIUM_ECONOMY", "Premium Economy (current selection)"),
+    (("economy",), "ECONOMY", "Economy (current selection)"),
+)
+_STORED_CABIN_RULES = (
+    (("first", "class"), "FIRST", "First Class preference"),
+    (("business",), "BUSINESS", "Business Class preference"),
+    (("premium",), "PREMIUM_ECONOMY", "Premium Economy preference"),
+    (("economy",), "ECONOMY", "Economy preference"),
+)
+_PASSENGER_RULES = (
+    (("alone",), 1, "traveling alone"),
+    (("solo",), 1, "traveling alone"),
+    (("2",), 2, "2 passengers"),
+    (("couple",), 2, "2 passengers"),
+    (("family",), 4, "family travel"),  # family default
+    (("kids",), 4, "family travel"),
+    (("children",), 4, "family travel"),
+)
+_AVOID_KEYWORDS = ("avoid", "hate", "don't like", "do not like")
+_TIMES_OF_DAY = ("morning", "afternoon", "evening")
+
+
+def _first_nonempty(d: dict, *keys: str) -> Optional[list]:
+    """Value of the first key in `keys` that is set and non-empty in `d`, else None."""
+    for key in keys:
+        value = d.get(key)
+        if value:
+            return value
+    return None
+
+
+def _match_rule(text: str, rules: tuple) -> Optional[tuple]:
+    for keywords, value, label in rules:
+        if all(kw in text for kw in keywords):
+            return value, label
+    return None
+
+
+def get_preference_overrides(user_id: str, current_preferences: Optional[dict] = None, prefs_cache: Optional[dict] = None) -> dict:
     """
     Get flight search parameter overrides from stored preferences.
     
@@ -875,8 +1205,8 @@ def get_preference_overrides(user_id: str, current_preferences: Optional[dict] =
     applied_prefs = []
     
     try:
-        prefs = memory_manager.summarize_preferences(user_id)
-        print(f"[PREFS DEBUG] Summarized preferences for user {user_id}: {prefs}")
+        prefs = _summarize_preferences(user_id, prefs_cache)
+        logger.debug("[PREFS DEBUG] Summarized preferences for user %s: %s", user_id, prefs)
 
         # Build a post-filtering preference payload for the flight results.
         # This is used by amadeus_client._filter_flights_by_preferences.
@@ -886,19 +1216,10 @@ def get_preference_overrides(user_id: str, current_preferences: Optional[dict] =
         if current_preferences:
             cabin = current_preferences.get("cabinClass")
             if isinstance(cabin, str) and cabin.strip():
-                cabin_l = cabin.strip().lower()
-                if "first" in cabin_l:
-                    overrides["travel_class"] = "FIRST"
-                    applied_prefs.append("First Class (current selection)")
-                elif "business" in cabin_l:
-                    overrides["travel_class"] = "BUSINESS"
-                    applied_prefs.append("Business Class (current selection)")
-                elif "premium" in cabin_l:
-                    overrides["travel_class"] = "PREMIUM_ECONOMY"
-                    applied_prefs.append("Premium Economy (current selection)")
-                elif "economy" in cabin_l:
-                    overrides["travel_class"] = "ECONOMY"
-                    applied_prefs.append("Economy (current selection)")
+                match = _match_rule(cabin.strip().lower(), _CURRENT_CABIN_RULES)
+                if match:
+                    overrides["travel_class"], label = match
+                    applied_prefs.append(label)
 
             if current_preferences.get("directFlightsOnly") is True:
                 overrides["non_stop"] = True
@@ -909,46 +1230,33 @@ def get_preference_overrides(user_id: str, current_preferences: Optional[dict] =
                 applied_prefs.append("avoid red-eye flights (current selection)")
         
         # Check for passenger preferences
-        passenger_items = (prefs.get("seat_preferences") or prefs.get("passenger") or prefs.get("passenger_preferences") or [])
+        passenger_items = _first_nonempty(prefs, "seat_preferences", "passenger", "passenger_preferences")
         if passenger_items:
-            seat_text = " ".join([str(item) for item in passenger_items]).lower()
+            seat_text = " ".join(map(str, passenger_items)).lower()
             print(f"[PREFS DEBUG] Seat preferences found: {seat_text}")
-            if "alone" in seat_text or "solo" in seat_text:
-                overrides["adults"] = 1
-                applied_prefs.append("traveling alone")
-            elif "2" in seat_text or "couple" in seat_text:
-                overrides["adults"] = 2
-                applied_prefs.append("2 passengers")
-            elif "family" in seat_text or "kids" in seat_text or "children" in seat_text:
-                overrides["adults"] = 4  # family default
-                applied_prefs.append("family travel")
+            match = _match_rule(seat_text, _PASSENGER_RULES)
+            if match:
+                overrides["adults"], label = match
+                applied_prefs.append(label)
         
         # Check for cabin class preferences - improved matching
         # (Only apply if current UI selection didn't already set it)
-        cabin_items = (prefs.get("cabin_class_preferences") or prefs.get("cabin_class") or [])
+        cabin_items = _first_nonempty(prefs, "cabin_class_preferences", "cabin_class")
         if not overrides.get("travel_class") and cabin_items:
-            cabin_text = " ".join([str(item) for item in cabin_items]).lower()
+            cabin_text = " ".join(map(str, cabin_items)).lower()
             print(f"[PREFS DEBUG] Cabin class preferences found: {cabin_text}")
-            # Check in order of priority to avoid false matches
-            if "first" in cabin_text and "class" in cabin_text:
-                overrides["travel_class"] = "FIRST"
-                applied_prefs.append("First Class preference")
-            elif "business" in cabin_text:
-                overrides["travel_class"] = "BUSINESS"
-                applied_prefs.append("Business Class preference")
-            elif "premium" in cabin_text:
-                overrides["travel_class"] = "PREMIUM_ECONOMY"
-                applied_prefs.append("Premium Economy preference")
-            elif "economy" in cabin_text:
-                overrides["travel_class"] = "ECONOMY"
-                applied_prefs.append("Economy preference")
+            # Rules are in priority order to avoid false matches
+            match = _match_rule(cabin_text, _STORED_CABIN_RULES)
+            if match:
+                overrides["travel_class"], label = match
+                applied_prefs.append(label)
         elif not overrides.get("travel_class"):
             print(f"[PREFS DEBUG] No cabin class preferences stored for user {user_id}")
         
         # Check for direct flight preferences (only if UI didn't already set it)
-        flight_items = (prefs.get("flight_type_preferences") or prefs.get("flight_type") or [])
+        flight_items = _first_nonempty(prefs, "flight_type_preferences", "flight_type")
         if overrides.get("non_stop") is None and flight_items:
-            flight_text = " ".join([str(item) for item in flight_items]).lower()
+            flight_text = " ".join(map(str, flight_items)).lower()
             print(f"[PREFS DEBUG] Flight type preferences found: {flight_text}")
             if "direct" in flight_text or "non-stop" in flight_text:
                 overrides["non_stop"] = True
@@ -956,51 +1264,62 @@ def get_preference_overrides(user_id: str, current_preferences: Optional[dict] =
 
         # Check for red-eye avoidance (only if UI didn't already set it)
         if user_preferences.get("avoid_red_eye") is not True:
-            red_eye_items = (prefs.get("red_eye_preferences") or prefs.get("red_eye") or [])
-            red_eye_text = " ".join([str(item) for item in red_eye_items]).lower()
-            if red_eye_text and ("red" in red_eye_text and "eye" in red_eye_text):
+            red_eye_items = _first_nonempty(prefs, "red_eye_preferences", "red_eye")
+            red_eye_text = " ".join(map(str, red_eye_items)).lower() if red_eye_items else ""
+            if "red" in red_eye_text and "eye" in red_eye_text:
                 user_preferences["avoid_red_eye"] = True
                 applied_prefs.append("avoid red-eye flights preference")
         
         # Check for time/departure preferences
-        if prefs.get("time_preferences") or prefs.get("departure_time"):
-            time_prefs = prefs.get("time_preferences", []) or prefs.get("departure_time", [])
-            time_text = " ".join([str(item) for item in time_prefs]).lower()
+        time_prefs = _first_nonempty(prefs, "time_preferences", "departure_time")
+        if time_prefs:
+            time_text = " ".join(map(str, time_prefs)).lower()
             print(f"[PREFS DEBUG] Time preferences found: {time_text}")
             if time_text:
                 overrides["time_preference"] = time_text
                 user_preferences["departure_time_preferences"] = [time_text]
                 # Avoidance semantics (e.g. "avoid afternoon")
-                if "avoid" in time_text or "hate" in time_text or "don't like" in time_text or "do not like" in time_text:
-                    if "morning" in time_text:
-                        applied_prefs.append("avoid morning flights")
-                    elif "afternoon" in time_text:
-                        applied_prefs.append("avoid afternoon flights")
-                    elif "evening" in time_text:
-                        applied_prefs.append("avoid evening flights")
-                    else:
-                        applied_prefs.append(f"avoid time preference: {time_text}")
-                elif "morning" in time_text:
-                    applied_prefs.append("morning flights")
-                elif "afternoon" in time_text:
-                    applied_prefs.append("afternoon flights")
-                elif "evening" in time_text:
-                    applied_prefs.append("evening flights")
+                avoid = "avoid " if any(kw in time_text for kw in _AVOID_KEYWORDS) else ""
+                time_of_day = next((t for t in _TIMES_OF_DAY if t in time_text), None)
+                if time_of_day:
+                    applied_prefs.append(f"{avoid}{time_of_day} flights")
                 else:
-                    applied_prefs.append(f"time preference: {time_text}")
+                    applied_prefs.append(f"{avoid}time preference: {time_text}")
         
         overrides["applied_prefs_summary"] = " & ".join(applied_prefs) if applied_prefs else None
         overrides["user_preferences"] = user_preferences
-        print(f"[PREFS] Extracted overrides for user {user_id}: {overrides}")
+        logger.debug("[PREFS] Extracted overrides for user %s: %s", user_id, overrides)
         return overrides
     except Exception as e:
         print(f"[PREFS ERROR] Error extracting preference overrides: {e}")
-        import traceback
-        traceback.print_exc()
-        return {}
+        logger.debug("[PREFS ERROR] Traceback:", exc_info=True)
         return {}
 
-def execute_tool(tool_name: str, arguments: dict, user_id: str, current_preferences: Optional[dict] = None) -> dict:
+def _slim_flight_for_llm(offer: dict) -> dict:
+    """Reduce a processed offer to the fields the model needs to describe it."""
+    itineraries = []
+    for itin in offer.get("itineraries", []):
+        segments = itin.get("segments") or [{}]
+        itineraries.append({
+            "from": segments[0].get("departure", {}).get("iataCode"),
+            "to": segments[-1].get("arrival", {}).get("iataCode"),
+            "departure": segments[0].get("departure", {}).get("at"),
+            "arrival": segments[-1].get("arrival", {}).get("at"),
+            "duration": itin.get("duration"),
+            "stops": len(segments) - 1,
+            "carriers": list(dict.fromkeys(seg.get("carrierName") or seg.get("carrierCode") for seg in segments)),
+            "flights": [f"{seg.get('carrierCode')}{seg.get('number')}" for seg in segments],
+        })
+    return {
+        "id": offer.get("id"),
+        "price": offer.get("price", {}).get("total"),
+        "currency": offer.get("price", {}).get("currency"),
+        "travelClass": offer.get("travelClass"),
+        "tags": offer.get("tags", []),
+        "itineraries": itineraries,
+    }
+
+async def execute_tool(tool_name: str, arguments: dict, user_id: str, current_preferences: Optional[dict] = None, prefs_cache: Optional[dict] = None) -> dict:
     """Execute a tool and return the result."""
     
     if tool_name == "search_flights":
@@ -1017,7 +1336,7 @@ def execute_tool(tool_name: str, arguments: dict, user_id: str, current_preferen
             non_stop = non_stop.lower() in ("true", "yes", "1")
         
         # Apply preference overrides (UI selection should win)
-        overrides = get_preference_overrides(user_id, current_preferences)
+        overrides = await asyncio.to_thread(get_preference_overrides, user_id, current_preferences, prefs_cache)
         adults = overrides.get("adults", adults)
         travel_class = overrides.get("travel_class", travel_class)
         non_stop = overrides.get("non_stop", non_stop)
@@ -1028,7 +1347,7 @@ def execute_tool(tool_name: str, arguments: dict, user_id: str, current_preferen
         print(f"[FLIGHT SEARCH] origin={origin}, destination={destination}, date={departure_date}")
         
         try:
-            result = amadeus_client.search_flights(
+            result = await amadeus_client.search_flights(
                 origin=origin,
                 destination=destination,
                 departure_date=departure_date,
@@ -1039,7 +1358,7 @@ def execute_tool(tool_name: str, arguments: dict, user_id: str, current_preferen
                 user_preferences=user_preferences,
             )
             
-            print(f"[FLIGHT SEARCH] Result: {result}")
+            logger.debug("[FLIGHT SEARCH] Result: %s", result)
             
             if result.get("error"):
                 print(f"[FLIGHT SEARCH] Error: {result['error']}")
@@ -1056,8 +1375,7 @@ def execute_tool(tool_name: str, arguments: dict, user_id: str, current_preferen
             }
         except Exception as e:
             print(f"[FLIGHT SEARCH] Exception: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.debug("[FLIGHT SEARCH] Traceback:", exc_info=True)
             return {"error": str(e), "flights": []}
     
     elif tool_name == "remember_preference":
@@ -1067,7 +1385,8 @@ def execute_tool(tool_name: str, arguments: dict, user_id: str, current_preferen
         pref_type = _infer_preference_memory_type(preference)
         # Store the preference directly. Avoid forcing memory_type="general" since
         # the memory layer intentionally filters "general" entries from the UI.
-        result = memory_manager.add_structured_memory(
+        result = await asyncio.to_thread(
+            memory_manager.add_structured_memory,
             user_id=user_id,
             category="preference",
             content=preference,
@@ -1084,76 +1403,158 @@ def execute_tool(tool_name: str, arguments: dict, user_id: str, current_preferen
     
     return {"error": "Unknown tool"}
 
+# Varied phrasings to avoid repetition
+_PREFERENCE_PHRASINGS = (
+    "Prefers {}",
+    "Likes {}",
+    "Interested in {}",
+    "Looking for {}",
+    "Going for {}",
+)
+
 def _merge_preferences(stored_prefs: dict, current_prefs: dict) -> dict:
     """
     Merge stored preferences (from mem0) with current UI preferences.
     Current preferences take priority as they're the latest selections.
     """
-    import random
-    
-    # Varied phrasings to avoid repetition
-    phrasings = [
-        lambda x: f"Prefers {x}",
-        lambda x: f"Likes {x}",
-        lambda x: f"Interested in {x}",
-        lambda x: f"Looking for {x}",
-        lambda x: f"Going for {x}",
-    ]
-    
     merged = {}
     
-    # Add all stored preferences
+    # Add all stored preferences (copied so appends below don't leak into the caller's lists)
     for category, items in stored_prefs.items():
         if items:
-            merged[category] = items
+            merged[category] = list(items)
     
     # Add/override with current UI preferences
-    phrasing_func = random.choice(phrasings)
+    phrasing = random.choice(_PREFERENCE_PHRASINGS)
     
     if current_prefs.get("directFlightsOnly"):
-        if "flight_type_preferences" not in merged:
-            merged["flight_type_preferences"] = []
-        if not any("direct" in str(item).lower() for item in merged["flight_type_preferences"]):
-            merged["flight_type_preferences"].append(f"{phrasing_func('direct flights only')}")
+        flight_types = merged.setdefault("flight_type_preferences", [])
+        if "direct" not in "\n".join(map(str, flight_types)).lower():
+            flight_types.append(phrasing.format("direct flights only"))
     
     if current_prefs.get("avoidRedEye"):
-        if "red_eye_preferences" not in merged:
-            merged["red_eye_preferences"] = []
-        if not any("red eye" in str(item).lower() or "evening" in str(item).lower() for item in merged["red_eye_preferences"]):
-            merged["red_eye_preferences"].append(f"{phrasing_func('avoiding red-eye flights')}")
+        red_eye = merged.setdefault("red_eye_preferences", [])
+        red_eye_text = "\n".join(map(str, red_eye)).lower()
+        if "red eye" not in red_eye_text and "evening" not in red_eye_text:
+            red_eye.append(phrasing.format("avoiding red-eye flights"))
     
     if current_prefs.get("cabinClass"):
-        if "cabin_class_preferences" not in merged:
-            merged["cabin_class_preferences"] = []
         # Clear old cabin class preferences
         cabin = current_prefs['cabinClass']
-        merged["cabin_class_preferences"] = [f"{phrasing_func(f'{cabin} cabin class')}"]
+        merged["cabin_class_preferences"] = [phrasing.format(f"{cabin} cabin class")]
     
     if current_prefs.get("preferredTime"):
-        if "time_preferences" not in merged:
-            merged["time_preferences"] = []
         # Clear old time preferences  
-        time = current_prefs['preferredTime']
-        merged["time_preferences"] = [f"{phrasing_func(f'{time} departures')}"]
+        time_pref = current_prefs['preferredTime']
+        merged["time_preferences"] = [phrasing.format(f"{time_pref} departures")]
     
     if current_prefs.get("tripType"):
-        if "trip_type_preferences" not in merged:
-            merged["trip_type_preferences"] = []
         trip = current_prefs['tripType']
-        merged["trip_type_preferences"] = [f"{phrasing_func(f'{trip} trips')}"]
+        merged["trip_type_preferences"] = [phrasing.format(f"{trip} trips")]
     
     return merged
 
-def process_message(user_message: str, user_id: str = "default-user", conversation_history: list = None, current_preferences: dict = None, username: str = None) -> dict:
+# Strong references to fire-and-forget tasks so they aren't garbage collected mid-run.
+_background_tasks: set[asyncio.Task] = set()
+# Caps concurrent background mem0 calls so bursts don't exhaust the thread pool.
+# Created on first use so it binds to the running loop (Python 3.9).
+BACKGROUND_CONCURRENCY = 5
+_background_slots: Optional[asyncio.Semaphore] = None
+
+
+async def _run_bounded(func, *args) -> None:
+    global _background_slots
+    if _background_slots is None:
+        _background_slots = asyncio.Semaphore(BACKGROUND_CONCURRENCY)
+    async with _background_slots:
+        await asyncio.to_thread(func, *args)
+
+
+def _run_in_background(func, *args) -> None:
+    """Run a blocking call in a worker thread without awaiting it."""
+    task = asyncio.ensure_future(_run_bounded(func, *args))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def _stream_assistant_message(on_delta: Callable[[str], Awaitable[None]], **kwargs) -> ChatCompletionMessage:
+    """Stream a completion, forwarding text deltas and reassembling any tool calls."""
+    stream = await client.chat.completions.create(stream=True, **kwargs)
+    content_parts: list[str] = []
+    calls: dict[int, dict] = {}
+    async for event in stream:
+        if not event.choices:
+            continue
+        delta = event.choices[0].delta
+        if delta.content:
+            content_parts.append(delta.content)
+            await on_delta(delta.content)
+        for tc in delta.tool_calls or ():
+            call = calls.setdefault(tc.index, {"id": "", "name": "", "arguments": []})
+            if tc.id:
+                call["id"] = tc.id
+            if tc.function:
+                if tc.function.name:
+                    call["name"] += tc.function.name
+                if tc.function.arguments:
+                    call["arguments"].append(tc.function.arguments)
+
+    tool_calls = [
+        ChatCompletionMessageFunctionToolCall(
+            id=call["id"],
+            type="function",
+            function=Function(name=call["name"], arguments="".join(call["arguments"])),
+        )
+        for _, call in sorted(calls.items())
+    ]
+    return ChatCompletionMessage(
+        role="assistant",
+        content="".join(content_parts) or None,
+        tool_calls=tool_calls or None,
+    )
+
+
+# Travel-history intents answered without the LLM. Phrases already covered by a
+# shorter one in the same tuple are left out ("frequent routes" also matches
+# "my frequent routes"), so each check is one substring scan per phrase.
+_TOP_COUNTRY_TRIGGERS = (
+    "most travelled country",
+    "most traveled country",
+    "most travelled countries",
+    "most traveled countries",
+    "most visited country",
+    "where do i travel most",
+)
+_FREQUENT_ROUTE_TRIGGERS = (
+    "routes do i travel frequently",
+    "frequent routes",
+    "routes i travel",
+    "where do i travel frequently",
+)
+_RECOMMENDATION_TRIGGERS = (
+    "recommend",
+    "suggest",
+    "ideas",
+    "where should i go",
+    "where to go",
+    "itinerary",
+    "plan a trip",
+)
+_HISTORY_CONTEXT_TRIGGERS = ("travel history", "my bookings")
+_TRAVEL_HISTORY_TRIGGERS = _HISTORY_CONTEXT_TRIGGERS + ("where have i traveled", "where have i been")
+
+
+async def process_message(user_message: str, user_id: str = "default-user", conversation_history: list = None, current_preferences: dict = None, username: str = None, on_delta: Optional[Callable[[str], Awaitable[None]]] = None) -> dict:
     """
     Process a user message and generate a response.
     
     Args:
         user_message: The user's message
         user_id: The user identifier
-        conversation_history: Previous messages in the conversation
+        conversation_history: Previous messages as {"role", "content"} dicts, oldest first
         current_preferences: Current UI preferences (directFlightsOnly, cabinClass, etc.)
         username: The user's username for personalized greetings
+        on_delta: Optional coroutine called with each chunk of the final reply as it streams
         
     Returns:
         dict with 'content' (str) and optionally 'flight_results' (list)
@@ -1161,35 +1562,29 @@ def process_message(user_message: str, user_id: str = "default-user", conversati
     if conversation_history is None:
         conversation_history = []
 
+    # Stored-preference summary shared by the memory prompt and tool calls for this message.
+    prefs_cache: dict = {}
+
+    # Lowercased once and shared by every keyword/regex check below.
+    message_lower = user_message.lower()
+
     # Convert free-form messages like "economy please" into effective current preferences
     # so the next search uses the updated cabin class immediately.
-    current_preferences = _augment_current_preferences_from_message(current_preferences, user_message)
+    current_preferences = _augment_current_preferences_from_message(current_preferences, user_message, message_lower)
     if current_preferences is None:
         current_preferences = {}
     
     # Special handling for preference queries
-    message_lower = user_message.lower()
-
-    def _looks_like_explicit_flight_search(text: str) -> bool:
-        t = (text or "").lower()
-        if not t.strip():
-            return False
-
-        # Strong intent verbs.
-        if re.search(r"\b(find|search|show|book|get|look\s*up|pull\s*up)\b", t):
-            return True
 
-        # Route pattern.
-        if re.search(r"\bfrom\b.+\bto\b", t):
-            return True
-
-        return False
+    def _looks_like_explicit_flight_search(text_lower: str) -> bool:
+        # Strong intent verbs, or a route pattern.
+        return bool(_SEARCH_VERB_RE.search(text_lower) or _FROM_TO_PHRASE_RE.search(text_lower))
 
     # Preference-only update guard:
     # Users often message things like "I hate afternoon flights" intending only to update preferences.
     # Do NOT automatically re-run the last route/search unless they explicitly asked to search.
-    extracted_prefs_only = extract_preferences_from_message(user_message)
-    if extracted_prefs_only and not _looks_like_explicit_flight_search(user_message):
+    extracted_prefs_only = extract_preferences_from_message(user_message, message_lower)
+    if extracted_prefs_only and not _looks_like_explicit_flight_search(message_lower):
         # Keep response concise; don't trigger any flight tools.
         # (The API layer persists extracted_preferences to DB/mem0.)
         confirmations = []
@@ -1204,20 +1599,8 @@ def process_message(user_message: str, user_id: str = "default-user", conversati
         }
 
     # Special handling for most traveled country queries
-    if any(
-        phrase in message_lower
-        for phrase in [
-            "most travelled country",
-            "most traveled country",
-            "most travelled countries",
-            "most traveled countries",
-            "most visited country",
-            "where do i travel most",
-            "what is my most traveled country",
-            "what is my most travelled country",
-        ]
-    ):
-        countries = _compute_most_travelled_countries(user_id, limit=3)
+    if any(phrase in message_lower for phrase in _TOP_COUNTRY_TRIGGERS):
+        countries = await _compute_most_travelled_countries(user_id, limit=3)
         if not countries:
             return {
                 "content": "I don't have any booking history yet, so I can't determine your most frequent destination country. Book a flight and then ask again.",
@@ -1238,19 +1621,8 @@ def process_message(user_message: str, user_id: str = "default-user", conversati
         return {"content": "\n".join(lines), "flight_results": None}
 
     # Special handling for frequent routes queries (based on travel history)
-    if any(
-        phrase in message_lower
-        for phrase in [
-            "routes do i travel frequently",
-            "what routes do i travel frequently",
-            "my frequent routes",
-            "frequent routes",
-            "most frequent routes",
-            "routes i travel",
-            "where do i travel frequently",
-        ]
-    ):
-        routes = _compute_frequent_routes(user_id, limit=5)
+    if any(phrase in message_lower for phrase in _FREQUENT_ROUTE_TRIGGERS):
+        routes = await _compute_frequent_routes(user_id, limit=5)
         if not routes:
             return {
                 "content": "You don't have any bookings yet, so I can't determine frequent routes. Book a flight and then ask again.",
@@ -1270,8 +1642,9 @@ def process_message(user_message: str, user_id: str = "default-user", conversati
             "flight_results": [],
         }
 
-    if any(word in message_lower for word in ["what are my preferences", "show my preferences", "what preferences do i have", "list my preferences", "my preferences"]):
-        pref_summary = memory_manager.summarize_preferences(user_id, include_ids=True)
+    # "what are my / show my / list my preferences" are all covered by "my preferences".
+    if "my preferences" in message_lower or "what preferences do i have" in message_lower:
+        pref_summary = await asyncio.to_thread(memory_manager.summarize_preferences, user_id, include_ids=True)
         print(f"[AGENT] Preference query detected. Summary: {pref_summary}")
         
         # Merge current UI preferences with stored preferences
@@ -1280,7 +1653,7 @@ def process_message(user_message: str, user_id: str = "default-user", conversati
 
         # Add frequent routes derived from travel history
         try:
-            frequent_routes = _compute_frequent_routes(user_id, limit=5)
+            frequent_routes = await _compute_frequent_routes(user_id, limit=5)
             if frequent_routes:
                 merged_prefs["routes"] = [
                     f"{r['route']} ({r['count']})" for r in frequent_routes if r.get("route")
@@ -1298,21 +1671,6 @@ def process_message(user_message: str, user_id: str = "default-user", conversati
         # Format preferences for display
         pref_lines = []
         
-        category_display = {
-            "seat": "🪑 Seat Preferences",
-            "airline": "✈️ Preferred Airlines",
-            "departure_time": "🕐 Time Preferences",
-            "flight_type": "🛫 Flight Type",
-            "cabin_class": "🎫 Cabin Class",
-            "red_eye": "🌙 Red-Eye Preferences",
-            "passenger": "👥 Passenger Type",
-            "baggage": "🎒 Baggage",
-            "routes": "🗺️ Favorite Routes",
-            "budget": "💰 Budget",
-            "trip_type": "✈️ Trip Type",
-            "location": "📍 Home Location",
-            "other": "📋 Other"
-        }
         
         has_any_preferences = False
         for category, items in merged_prefs.items():
@@ -1349,7 +1707,7 @@ def process_message(user_message: str, user_id: str = "default-user", conversati
                     has_any_preferences = True
                     if not pref_lines:  # Add header only if we have preferences
                         pref_lines.append("Here are your currently stored travel preferences:\n")
-                    display_name = category_display.get(category, category.replace("_", " ").title())
+                    display_name = _CATEGORY_DISPLAY_REPLY.get(category, category.replace("_", " ").title())
                     pref_lines.append(f"\n{display_name}:")
                     for item_text in valid_items:
                         pref_lines.append(f"  • {item_text}")
@@ -1365,51 +1723,19 @@ def process_message(user_message: str, user_id: str = "default-user", conversati
         }
     
     # Special handling for recommendations based on travel history
-    recommendation_triggers = [
-        "recommend",
-        "suggest",
-        "recommendation",
-        "ideas",
-        "where should i go",
-        "where to go",
-        "itinerary",
-        "plan a trip",
-    ]
-    history_context_triggers = [
-        "based on my travel history",
-        "based on my bookings",
-        "based on travel history",
-        "my travel history",
-        "travel history",
-        "my bookings",
-    ]
-
-    if any(t in message_lower for t in recommendation_triggers) and any(
-        t in message_lower for t in history_context_triggers
-    ):
+    wants_recommendation = any(t in message_lower for t in _RECOMMENDATION_TRIGGERS)
+    if wants_recommendation and any(t in message_lower for t in _HISTORY_CONTEXT_TRIGGERS):
         print(f"[AGENT] Travel-history-based recommendation query detected for user {user_id}")
         return {
-            "content": _recommendations_from_history(user_id, solo=("solo" in message_lower)),
+            "content": await _recommendations_from_history(user_id, solo=("solo" in message_lower)),
             "extracted_preferences": [],
             "flight_results": [],
         }
 
     # Special handling for travel history queries
-    if any(
-        word in message_lower
-        for word in [
-            "show my travel history",
-            "list my travel history",
-            "show travel history",
-            "show my bookings",
-            "my bookings",
-            "where have i traveled",
-            "where have i been",
-            "travel history",
-        ]
-    ) and not any(t in message_lower for t in recommendation_triggers):
+    if not wants_recommendation and any(t in message_lower for t in _TRAVEL_HISTORY_TRIGGERS):
         print(f"[AGENT] Travel history query detected for user {user_id}")
-        travel_history_items = _get_travel_history_items(user_id, limit=50)
+        travel_history_items = await _get_travel_history_items(user_id, limit=50)
         print(f"[AGENT] Returning {len(travel_history_items) if travel_history_items else 0} travel history items")
 
         if not travel_history_items:
@@ -1430,7 +1756,8 @@ def process_message(user_message: str, user_id: str = "default-user", conversati
             "travel_history": travel_history_items
         }
     
-    system_prompt = get_system_prompt_with_memory(user_id)
+    system_prompt = get_system_prompt()
+    memory_prompt = await asyncio.to_thread(get_memory_prompt, user_id, prefs_cache)
     
     # Extract last flight search context if user is expressing new preferences.
     # Provide this as optional context only; do NOT force an automatic re-search.
@@ -1439,122 +1766,155 @@ def process_message(user_message: str, user_id: str = "default-user", conversati
         # Look for previous flight search in conversation history
         last_search_context = None
         for msg in reversed(conversation_history[-10:]):
-            content = msg.get("content", "").lower()
+            content = msg.get("content", "")
+            lowered = content.lower()
             # Look for mentions of airports/routes
-            if any(word in content for word in ["houston", "kathmandu", "hyderabad", "new york", "iath", "ktm", "hyd", "jfk"]):
-                if any(word in content for word in ["search", "find", "flight", "from", "to"]):
-                    last_search_context = msg.get("content", "")
-                    break
+            if _ROUTE_HINT_RE.search(lowered) and _SEARCH_HINT_RE.search(lowered):
+                last_search_context = content
+                break
         
         if last_search_context:
-            system_prompt += "\n\nRECENT SEARCH CONTEXT:\n"
-            system_prompt += f"The user recently searched for: {last_search_context}\n"
-            system_prompt += "If the user asks to re-run the search, reuse the same route/dates and apply the new preference."
+            memory_prompt = (
+                f"{memory_prompt}\n\nRECENT SEARCH CONTEXT:\n"
+                f"The user recently searched for: {last_search_context}\n"
+                "If the user asks to re-run the search, reuse the same route/dates and apply the new preference."
+            )
     
+    # Static prompt first so it forms a shared cacheable prefix; per-user context follows.
     messages = [{"role": "system", "content": system_prompt}]
+    if memory_prompt:
+        messages.append({"role": "system", "content": memory_prompt.strip()})
     
     # Add greeting with username if this is the first message in a new conversation
     greeting_prefix = ""
     if username and len(conversation_history) == 0:
-        greetings = [
-            f"Hey {username}! 👋 I'm excited to help you find the perfect flights!",
-            f"Welcome, {username}! Ready to start your travel adventure?",
-            f"Hi {username}! Let's find some amazing flights for you.",
-            f"Great to see you, {username}! How can I help with your travel plans?",
-        ]
-        import random
-        greeting_prefix = random.choice(greetings) + "\n\n"
+        greeting_prefix = random.choice(_GREETINGS).format(username=username) + "\n\n"
     
-    for msg in conversation_history[-10:]:
-        messages.append({
-            "role": msg.get("role", "user"),
-            "content": msg.get("content", "")
-        })
+    messages.extend(conversation_history[-10:])
     
     messages.append({"role": "user", "content": user_message})
     
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            tools=TOOLS,
-            tool_choice="auto",
-            max_tokens=2048
-        )
-        
-        assistant_message = response.choices[0].message
+        completion_args = {
+            "model": "gpt-4o",
+            "messages": messages,
+            "tools": TOOLS,
+            "tool_choice": "auto",
+            "max_tokens": 2048,
+        }
+        if on_delta:
+            # Stream the first round too: a direct answer reaches the client as it is
+            # generated, and tool calls are reassembled from their deltas.
+            assistant_message = await _stream_assistant_message(on_delta, **completion_args)
+        else:
+            response = await client.chat.completions.create(**completion_args)
+            assistant_message = response.choices[0].message
+        # Whether the first round's text was already sent to the client
+        content_streamed = bool(on_delta and assistant_message.content)
         flight_results = []
         memory_context = None
         applied_prefs_summary = None
         
         if assistant_message.tool_calls:
-            tool_results = []
-            
-            for tool_call in assistant_message.tool_calls:
-                tool_name = tool_call.function.name
-                arguments = json.loads(tool_call.function.arguments)
-                
-                result = execute_tool(tool_name, arguments, user_id, current_preferences)
-                tool_results.append({
-                    "tool_call_id": tool_call.id,
-                    "output": json.dumps(result)
-                })
+            # The greeting opens tool replies. Text the model wrote alongside its
+            # tool calls has already opened the streamed reply, so on both
+            # transports it is kept and the greeting is left out.
+            if assistant_message.content:
+                preamble = f"{assistant_message.content}\n\n"
+                greeting_prefix = ""
+            else:
+                preamble = ""
+
+            async def run_tool(name: str, raw_arguments: str) -> dict:
+                arguments = orjson.loads(raw_arguments)
+                return await execute_tool(name, arguments, user_id, current_preferences, prefs_cache)
+
+            # The model occasionally repeats an identical call; run each distinct
+            # (name, arguments) pair once and share the result between call ids.
+            call_keys = [(tc.function.name, tc.function.arguments) for tc in assistant_message.tool_calls]
+            unique_keys = list(dict.fromkeys(call_keys))
+            unique_results = await asyncio.gather(*(run_tool(name, args) for name, args in unique_keys))
+            results_by_key = dict(zip(unique_keys, unique_results))
+            results = [results_by_key[key] for key in call_keys]
+
+            # Only the fields the API accepts back on an assistant turn (not annotations/refusal).
+            messages.append(assistant_message.model_dump(include={"role", "content", "tool_calls"}, exclude_none=True))
+
+            # Tool messages go straight onto the conversation; repeated calls reuse one serialization.
+            outputs_by_key: dict[tuple[str, str], str] = {}
+            for tool_call, key, result in zip(assistant_message.tool_calls, call_keys, results):
+                tool_name = key[0]
+                output = outputs_by_key.get(key)
+                if output is None:
+                    # The UI gets full offers via flight_results; the model only needs a summary.
+                    llm_result = result
+                    if tool_name == "search_flights" and result.get("flights"):
+                        llm_result = {**result, "flights": [_slim_flight_for_llm(f) for f in result["flights"]]}
+                    output = outputs_by_key[key] = orjson.dumps(llm_result, option=orjson.OPT_NON_STR_KEYS).decode()
+                messages.append({"role": "tool", "tool_call_id": tool_call.id, "content": output})
                 
                 if tool_name == "search_flights" and result.get("flights"):
                     flight_results = result["flights"]
-                    # Get preference summary for this search
-                    overrides = get_preference_overrides(user_id, current_preferences)
-                    applied_prefs_summary = overrides.get("applied_prefs_summary")
+                    # Preference summary computed by execute_tool for this search
+                    applied_prefs_summary = result.get("applied_preferences")
                 
                 if tool_name == "remember_preference":
                     # Use the confirmation message from the tool
                     memory_context = result.get("confirmation", f"Noted: {result.get('preference', '')}")
             
-            messages.append({
-                "role": "assistant",
-                "content": assistant_message.content or "",
-                "tool_calls": [
-                    {
-                        "id": tc.id,
-                        "type": "function",
-                        "function": {
-                            "name": tc.function.name,
-                            "arguments": tc.function.arguments
-                        }
-                    }
-                    for tc in assistant_message.tool_calls
-                ]
-            })
-            
-            for tr in tool_results:
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": tr["tool_call_id"],
-                    "content": tr["output"]
-                })
-            
-            final_response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages,
-                max_tokens=2048
-            )
-            
-            final_content = final_response.choices[0].message.content
+            if all(name == "remember_preference" for name, _ in call_keys):
+                # Nothing to narrate: reply with the tool confirmations instead of a
+                # second completion round-trip.
+                final_content = assistant_message.content or "\n".join(
+                    dict.fromkeys(r.get("confirmation") or f"I'll remember: {r.get('preference', '')}" for r in results)
+                )
+                if on_delta and not content_streamed:
+                    await on_delta(greeting_prefix + final_content)
+            elif on_delta:
+                # Stream the final answer so the client sees the first tokens immediately.
+                if content_streamed:
+                    await on_delta("\n\n")
+                elif greeting_prefix:
+                    await on_delta(greeting_prefix)
+                stream = await client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=messages,
+                    max_tokens=2048,
+                    stream=True
+                )
+                chunks = []
+                async for event in stream:
+                    if not event.choices:
+                        continue
+                    delta = event.choices[0].delta.content
+                    if delta:
+                        chunks.append(delta)
+                        await on_delta(delta)
+                final_content = preamble + "".join(chunks)
+            else:
+                final_response = await client.chat.completions.create(
+                    model="gpt-4o",
+                    messages=messages,
+                    max_tokens=2048
+                )
+                final_content = preamble + final_response.choices[0].message.content
             
             # Add greeting if this is the first message
             if greeting_prefix:
                 final_content = greeting_prefix + final_content
             
-            # Extract preferences from user message (persistence handled by API layer)
-            extracted_preferences = extract_preferences_from_message(user_message)
-            print(f"[AGENT] Extracted preferences from message: {extracted_preferences}")
+            # Preferences extracted from the user message at the top of this turn
+            # (persistence handled by API layer)
+            extracted_preferences = persistable_preferences(extracted_prefs_only, message_lower)
+            logger.debug("[AGENT] Extracted preferences from message: %s", extracted_preferences)
             
-            # Also do the general memory extraction
-            memory_manager.extract_and_store_preferences(user_id, user_message, final_content)
+            # General memory extraction, off the response path (skipped when the
+            # API layer is about to store the preferences extracted above).
+            _run_in_background(memory_manager.extract_and_store_preferences, user_id, user_message, final_content, extracted_preferences)
             
-            preferences = memory_manager.get_preferences_summary(user_id)
-            if preferences:
-                memory_context = "Using your preferences"
+            # get_preferences_summary always returns a non-empty string, so this
+            # label never depended on the (blocking) mem0 search behind it.
+            memory_context = "Using your preferences"
             
             return {
                 "content": final_content,
@@ -1565,11 +1925,13 @@ def process_message(user_message: str, user_id: str = "default-user", conversati
             }
         
         content = assistant_message.content or "I'm sorry, I couldn't generate a response."
+        if on_delta and not content_streamed:
+            await on_delta(content)
         
-        memory_manager.extract_and_store_preferences(user_id, user_message, content)
+        # Preferences extracted from the user message, returned to be displayed
+        extracted_preferences = persistable_preferences(extracted_prefs_only, message_lower)
         
-        # Extract preferences from user message and return them to be displayed
-        extracted_preferences = extract_preferences_from_message(user_message)
+        _run_in_background(memory_manager.extract_and_store_preferences, user_id, user_message, content, extracted_preferences)
         
         return {
             "content": content,
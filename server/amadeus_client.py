@@ -1,28 +1,112 @@
 import os
-import requests
+import re
+import logging
+import sys
+import time
+import asyncio
+import hashlib
+import httpx
+import orjson
+from collections import OrderedDict
 from datetime import datetime
 from typing import Optional
 import json
 
+logger = logging.getLogger(__name__)
+
+_PT_DURATION_RE = re.compile(r'PT(?:(\d+)H)?(?:(\d+)M)?')
+
+
 class AmadeusClient:
     """Client for interacting with Amadeus Flight API."""
     
     BASE_URL = "https://test.api.amadeus.com"
+
+    # Flight-offer cache: successful searches are reused for a few minutes and
+    # Amadeus 4xx validation errors briefly. Transport errors, 429s and 5xx are
+    # never cached, so the next identical search tries again.
+    SEARCH_CACHE_TTL = 600
+    SEARCH_ERROR_TTL = 30
+    SEARCH_CACHE_MAXSIZE = 2048
+    # Processed offers keyed by a digest of the raw response body, so identical
+    # payloads (e.g. a re-fetch after the search cache expires) skip reprocessing.
+    PROCESSED_CACHE_MAXSIZE = 256
+    # Resolved airport display names / countries, evicted least recently used first.
+    IATA_CACHE_MAXSIZE = 4096
+
+    # Amadeus answers 429 under its per-second quota and occasional 5xx on the test
+    # environment; retry those with a short exponential backoff.
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+    MAX_RETRIES = 3
+    RETRY_BACKOFF = 0.2
+    # Longest Retry-After we will wait out inside a chat turn; longer asks fail fast.
+    RETRY_AFTER_MAX = 2.0
     
     def __init__(self):
         self.api_key = os.environ.get("AMADEUS_API_KEY")
         self.api_secret = os.environ.get("AMADEUS_API_SECRET")
         self.access_token = None
         self.token_expires_at = None
-        self._iata_display_cache: dict[str, str] = {}
-        self._iata_country_cache: dict[str, str] = {}
+        # Created on first use so it binds to the server's event loop (Python 3.9).
+        self._token_lock: Optional[asyncio.Lock] = None
+        self._iata_display_cache: OrderedDict[str, str] = OrderedDict()
+        self._iata_country_cache: OrderedDict[str, str] = OrderedDict()
+        # One pooled client for every Amadeus call so the TLS session and HTTP/2
+        # connection are reused across token refreshes, lookups and searches.
+        # The transport also retries failed connection attempts.
+        self._http = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=self.MAX_RETRIES,
+                limits=httpx.Limits(max_keepalive_connections=32),
+            ),
+            timeout=20.0,
+        )
+        self._search_cache: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._search_inflight: dict[str, asyncio.Future] = {}
+        self._processed_cache: OrderedDict[bytes, dict] = OrderedDict()
+
+    async def aclose(self) -> None:
+        """Close the underlying HTTP connection pool."""
+        await self._http.aclose()
+
+    async def _send(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request on the pooled client, retrying rate-limit and server errors."""
+        for attempt in range(self.MAX_RETRIES + 1):
+            response = await self._http.request(method, url, **kwargs)
+            if response.status_code not in self.RETRY_STATUSES or attempt == self.MAX_RETRIES:
+                return response
+            retry_after = response.headers.get("Retry-After", "")
+            delay = float(retry_after) if retry_after.isdigit() else self.RETRY_BACKOFF * (2 ** attempt)
+            if delay > self.RETRY_AFTER_MAX:
+                print(f"[AMADEUS] {response.status_code} from {url}, Retry-After {delay:.0f}s is too long; giving up")
+                return response
+            print(f"[AMADEUS] {response.status_code} from {url}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        return response
         
-    def _get_access_token(self) -> str:
+    def _token_is_fresh(self) -> bool:
+        return bool(
+            self.access_token
+            and self.token_expires_at
+            and datetime.now().timestamp() < self.token_expires_at - 60
+        )
+
+    async def _get_access_token(self) -> str:
         """Get or refresh the access token."""
-        if self.access_token and self.token_expires_at:
-            if datetime.now().timestamp() < self.token_expires_at - 60:
-                return self.access_token
+        if self._token_is_fresh():
+            return self.access_token
         
+        # Only one coroutine refreshes; the rest wait and reuse the new token.
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            if self._token_is_fresh():
+                print("[AMADEUS] Token already refreshed by a concurrent request")
+                return self.access_token
+            return await self._refresh_access_token()
+    
+    async def _refresh_access_token(self) -> str:
         url = f"{self.BASE_URL}/v1/security/oauth2/token"
         data = {
             "grant_type": "client_credentials",
@@ -30,11 +114,11 @@ class AmadeusClient:
             "client_secret": self.api_secret
         }
         
-        print(f"[DEBUG] Requesting token from {url} with client_id={self.api_key}")
+        logger.debug("[DEBUG] Requesting token from %s", url)
         
-        response = requests.post(url, data=data)
+        response = await self._send("POST", url, data=data)
         
-        print(f"[DEBUG] Token response: {response.text}")
+        logger.debug("[DEBUG] Token response status: %s", response.status_code)
         
         if response.status_code != 200:
             raise Exception(f"Failed to get access token: {response.text}")
@@ -45,15 +129,15 @@ class AmadeusClient:
         
         return self.access_token
     
-    def _get_headers(self) -> dict:
+    async def _get_headers(self) -> dict:
         """Get authorization headers."""
-        token = self._get_access_token()
+        token = await self._get_access_token()
         return {
             "Authorization": f"Bearer {token}",
             "Content-Type": "application/json"
         }
 
-    def resolve_airport_display(self, iata_code: str) -> str:
+    async def resolve_airport_display(self, iata_code: str) -> str:
         """Resolve an airport IATA code to a human-friendly display name.
 
         Returns a string like "Houston (IAH)" when possible; falls back to "IAH".
@@ -72,6 +156,7 @@ class AmadeusClient:
 
         cached = self._iata_display_cache.get(code)
         if cached:
+            self._iata_display_cache.move_to_end(code)
             return cached
 
         url = f"{self.BASE_URL}/v1/reference-data/locations"
@@ -83,8 +168,8 @@ class AmadeusClient:
         }
 
         try:
-            headers = self._get_headers()
-            resp = requests.get(url, headers=headers, params=params, timeout=10)
+            headers = await self._get_headers()
+            resp = await self._send("GET", url, headers=headers, params=params, timeout=10)
             if resp.status_code != 200:
                 return fallback.get(code, code)
             payload = resp.json() or {}
@@ -114,13 +199,19 @@ class AmadeusClient:
 
             # Cache only successful resolutions (not raw codes).
             if resolved != code:
-                self._iata_display_cache[code] = resolved
+                self._iata_cache_set(self._iata_display_cache, code, resolved)
 
             return resolved
         except Exception:
             return fallback.get(code, code)
 
-    def resolve_airport_country(self, iata_code: str) -> Optional[str]:
+    def _iata_cache_set(self, cache: OrderedDict, code: str, value: str) -> None:
+        cache[code] = value
+        cache.move_to_end(code)
+        while len(cache) > self.IATA_CACHE_MAXSIZE:
+            cache.popitem(last=False)
+
+    async def resolve_airport_country(self, iata_code: str) -> Optional[str]:
         """Resolve an airport/city IATA code to a country name when possible."""
         if not isinstance(iata_code, str):
             return None
@@ -130,6 +221,7 @@ class AmadeusClient:
 
         cached = self._iata_country_cache.get(code)
         if cached:
+            self._iata_country_cache.move_to_end(code)
             return cached
 
         # Fallback map for common codes we see during local testing.
@@ -161,8 +253,8 @@ class AmadeusClient:
         }
 
         try:
-            headers = self._get_headers()
-            resp = requests.get(url, headers=headers, params=params, timeout=10)
+            headers = await self._get_headers()
+            resp = await self._send("GET", url, headers=headers, params=params, timeout=10)
             if resp.status_code != 200:
                 return fallback.get(code)
 
@@ -206,12 +298,12 @@ class AmadeusClient:
             if len(country) > 2:
                 country = country.title()
 
-            self._iata_country_cache[code] = country
+            self._iata_cache_set(self._iata_country_cache, code, country)
             return country
         except Exception:
             return fallback.get(code)
     
-    def search_flights(
+    async def search_flights(
         self,
         origin: str,
         destination: str,
@@ -278,25 +370,18 @@ class AmadeusClient:
         if max_price:
             params["maxPrice"] = max_price
             
+        cache_key = "amadeus:" + "|".join(f"{k}={v}" for k, v in sorted(params.items()))
+        cached = await self._get_offers_cached(cache_key, url, params)
+        if cached.get("error"):
+            return {"error": cached["error"], "data": []}
+
         try:
-            print(f"[AMADEUS] Fetching token...")
-            headers = self._get_headers()
-            print(f"[AMADEUS] Token obtained, sending request to {url}")
-            print(f"[AMADEUS] Params: {params}")
-            print(f"[DEBUG] Final Params Sent to Amadeus API: {params}")
-            
-            response = requests.get(url, headers=headers, params=params)
-            
-            print(f"[AMADEUS] Response status: {response.status_code}")
-            print(f"[AMADEUS] Response: {response.text}")
-            
-            if response.status_code != 200:
-                error_msg = response.json().get("errors", [{}])[0].get("detail", response.text)
-                print(f"[AMADEUS] Error: {error_msg}")
-                return {"error": error_msg, "data": []}
-            
-            data = response.json()
-            processed = self._process_flight_offers(data)
+            # Cached offers are shared between callers; downstream code only sets
+            # top-level keys (travelClass, tags), so a shallow copy per offer is enough.
+            processed = {
+                "data": [dict(o) for o in cached.get("data", [])],
+                "meta": cached.get("meta", {}),
+            }
 
             # If a specific cabin was requested, only return that cabin.
             # Amadeus sometimes includes multiple cabin values in traveler pricing; our processing
@@ -319,6 +404,96 @@ class AmadeusClient:
             
         except Exception as e:
             return {"error": str(e), "data": []}
+
+    def _search_cache_get(self, cache_key: str) -> Optional[dict]:
+        entry = self._search_cache.get(cache_key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            self._search_cache.pop(cache_key, None)
+            return None
+        self._search_cache.move_to_end(cache_key)
+        return value
+
+    def _search_cache_set(self, cache_key: str, value: dict, ttl: float) -> None:
+        self._search_cache[cache_key] = (time.monotonic() + ttl, value)
+        self._search_cache.move_to_end(cache_key)
+        while len(self._search_cache) > self.SEARCH_CACHE_MAXSIZE:
+            self._search_cache.popitem(last=False)
+
+    async def _get_offers_cached(self, cache_key: str, url: str, params: dict) -> dict:
+        """Return processed offers for `params`, served from the TTL cache when possible.
+
+        Concurrent identical searches share a single in-flight Amadeus request.
+        """
+        cached = self._search_cache_get(cache_key)
+        if cached is not None:
+            print(f"[AMADEUS] Cache hit for {cache_key}")
+            return cached
+
+        pending = self._search_inflight.get(cache_key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._fetch_offers(url, params))
+            self._search_inflight[cache_key] = pending
+            pending.add_done_callback(lambda _f: self._search_inflight.pop(cache_key, None))
+
+            def _store(f: asyncio.Future) -> None:
+                if f.cancelled() or f.exception() is not None:
+                    return
+                result, cacheable = f.result()
+                if not cacheable:
+                    return
+                ttl = self.SEARCH_ERROR_TTL if result.get("error") else self.SEARCH_CACHE_TTL
+                self._search_cache_set(cache_key, result, ttl)
+
+            pending.add_done_callback(_store)
+
+        result, _cacheable = await asyncio.shield(pending)
+        return result
+
+    async def _fetch_offers(self, url: str, params: dict) -> tuple[dict, bool]:
+        """Call the Amadeus flight-offers endpoint and process the response.
+
+        Returns (result, cacheable). Only successes and deterministic 4xx
+        validation errors are cacheable; transient failures are not.
+        """
+        try:
+            print(f"[AMADEUS] Fetching token...")
+            headers = await self._get_headers()
+            print(f"[AMADEUS] Token obtained, sending request to {url}")
+            logger.debug("[AMADEUS] Params: %s", params)
+            
+            response = await self._send("GET", url, headers=headers, params=params)
+            
+            print(f"[AMADEUS] Response status: {response.status_code}")
+            if logger.isEnabledFor(logging.DEBUG):
+                # Decoding the body is costly for large offer payloads; skip it unless asked.
+                logger.debug("[AMADEUS] Response: %s", response.text)
+            
+            if response.status_code != 200:
+                error_msg = response.json().get("errors", [{}])[0].get("detail", response.text)
+                print(f"[AMADEUS] Error: {error_msg}")
+                # 429 has already been retried by _send and may clear; other 4xx
+                # reject these exact params and will again.
+                cacheable = 400 <= response.status_code < 500 and response.status_code != 429
+                return {"error": error_msg, "data": []}, cacheable
+            
+            digest = hashlib.blake2b(response.content, digest_size=16).digest()
+            processed = self._processed_cache.get(digest)
+            if processed is not None:
+                self._processed_cache.move_to_end(digest)
+                return processed, True
+            
+            processed = self._process_flight_offers(orjson.loads(response.content))
+            self._processed_cache[digest] = processed
+            if len(self._processed_cache) > self.PROCESSED_CACHE_MAXSIZE:
+                self._processed_cache.popitem(last=False)
+            return processed, True
+            
+        except Exception as e:
+            # Timeouts, connection errors, non-JSON error bodies: transient.
+            return {"error": str(e), "data": []}, False
     
     def _process_flight_offers(self, raw_data: dict) -> dict:
         """Process and enrich flight offers data."""
@@ -328,13 +503,16 @@ class AmadeusClient:
         
         processed_offers = []
         
+        # Airport codes and carrier names repeat across every segment of every
+        # offer; interning them lets cached results share one copy of each string.
         for offer in offers:
+            price = offer["price"]
             base_processed = {
                 "id": offer["id"],
                 "price": {
-                    "total": offer["price"]["total"],
-                    "currency": offer["price"]["currency"],
-                    "base": offer["price"].get("base", offer["price"]["total"])
+                    "total": price["total"],
+                    "currency": price["currency"],
+                    "base": price.get("base", price["total"])
                 },
                 "numberOfBookableSeats": offer.get("numberOfBookableSeats"),
                 "validatingAirlineCodes": offer.get("validatingAirlineCodes", []),
@@ -348,20 +526,22 @@ class AmadeusClient:
                 }
                 
                 for segment in itinerary["segments"]:
-                    carrier_code = segment["carrierCode"]
+                    carrier_code = sys.intern(segment["carrierCode"])
+                    departure = segment["departure"]
+                    arrival = segment["arrival"]
                     processed_segment = {
                         "departure": {
-                            "iataCode": segment["departure"]["iataCode"],
-                            "terminal": segment["departure"].get("terminal"),
-                            "at": segment["departure"]["at"]
+                            "iataCode": sys.intern(departure["iataCode"]),
+                            "terminal": departure.get("terminal"),
+                            "at": departure["at"]
                         },
                         "arrival": {
-                            "iataCode": segment["arrival"]["iataCode"],
-                            "terminal": segment["arrival"].get("terminal"),
-                            "at": segment["arrival"]["at"]
+                            "iataCode": sys.intern(arrival["iataCode"]),
+                            "terminal": arrival.get("terminal"),
+                            "at": arrival["at"]
                         },
                         "carrierCode": carrier_code,
-                        "carrierName": carriers.get(carrier_code, carrier_code),
+                        "carrierName": sys.intern(carriers.get(carrier_code, carrier_code)),
                         "number": segment["number"],
                         "aircraft": segment.get("aircraft", {}).get("code"),
                         "duration": segment["duration"],
@@ -377,13 +557,12 @@ class AmadeusClient:
             
             if traveler_pricings:
                 # Get all unique cabin classes from this flight
-                cabin_classes = set()
-                for pricing in traveler_pricings:
-                    fare_details = pricing.get("fareDetailsBySegment", [])
-                    for detail in fare_details:
-                        cabin = detail.get("cabin")
-                        if cabin:
-                            cabin_classes.add(cabin)
+                cabin_classes = {
+                    detail["cabin"]
+                    for pricing in traveler_pricings
+                    for detail in pricing.get("fareDetailsBySegment", [])
+                    if detail.get("cabin")
+                }
                 
                 # If we found multiple cabin classes, create separate entries for each
                 if cabin_classes:
@@ -521,56 +700,46 @@ class AmadeusClient:
         if not offers:
             return offers
         
-        prices = [(i, float(o["price"]["total"])) for i, o in enumerate(offers)]
+        # One pass over the offers: price and total duration (minutes) per index.
+        prices = []
         durations = []
-        
-        for i, offer in enumerate(offers):
+        for offer in offers:
+            prices.append(float(offer["price"]["total"]))
             total_mins = 0
             for itin in offer["itineraries"]:
-                duration = itin["duration"]
-                import re
-                match = re.match(r'PT(\d+H)?(\d+M)?', duration)
+                match = _PT_DURATION_RE.match(itin["duration"])
                 if match:
-                    hours = int(match.group(1)[:-1]) if match.group(1) else 0
-                    mins = int(match.group(2)[:-1]) if match.group(2) else 0
+                    hours = int(match.group(1) or 0)
+                    mins = int(match.group(2) or 0)
                     total_mins += hours * 60 + mins
-            durations.append((i, total_mins))
+            durations.append(total_mins)
         
         for offer in offers:
             offer["tags"] = []
         
-        if prices:
-            cheapest_idx = min(prices, key=lambda x: x[1])[0]
-            offers[cheapest_idx]["tags"].append("cheapest")
+        indices = range(len(offers))
+        cheapest_idx = min(indices, key=prices.__getitem__)
+        fastest_idx = min(indices, key=durations.__getitem__)
+        offers[cheapest_idx]["tags"].append("cheapest")
+        offers[fastest_idx]["tags"].append("fastest")
         
-        if durations:
-            fastest_idx = min(durations, key=lambda x: x[1])[0]
-            offers[fastest_idx]["tags"].append("fastest")
+        price_min, price_max = prices[cheapest_idx], max(prices)
+        dur_min, dur_max = durations[fastest_idx], max(durations)
+        price_span = price_max - price_min
+        dur_span = dur_max - dur_min
         
-        if prices and durations:
-            price_min = min(p[1] for p in prices)
-            price_max = max(p[1] for p in prices) or price_min + 1
-            dur_min = min(d[1] for d in durations)
-            dur_max = max(d[1] for d in durations) or dur_min + 1
-            
-            best_score = float('inf')
-            best_idx = 0
-            
-            for i, offer in enumerate(offers):
-                price = float(offer["price"]["total"])
-                dur = next(d[1] for d in durations if d[0] == i)
-                
-                price_norm = (price - price_min) / (price_max - price_min) if price_max != price_min else 0
-                dur_norm = (dur - dur_min) / (dur_max - dur_min) if dur_max != dur_min else 0
-                
-                score = 0.6 * price_norm + 0.4 * dur_norm
-                
-                if score < best_score:
-                    best_score = score
-                    best_idx = i
-            
-            if "cheapest" not in offers[best_idx]["tags"] and "fastest" not in offers[best_idx]["tags"]:
-                offers[best_idx]["tags"].append("best")
+        best_score = float('inf')
+        best_idx = 0
+        for i in indices:
+            price_norm = (prices[i] - price_min) / price_span if price_span else 0
+            dur_norm = (durations[i] - dur_min) / dur_span if dur_span else 0
+            score = 0.6 * price_norm + 0.4 * dur_norm
+            if score < best_score:
+                best_score = score
+                best_idx = i
+        
+        if best_idx != cheapest_idx and best_idx != fastest_idx:
+            offers[best_idx]["tags"].append("best")
         
         return offers
 
@@ -621,6 +621,31 @@ class DatabaseStorage:
         finally:
             db.close()
     
+    def add_messages(self, conversation_id: str, messages: list) -> dict:
+        """Append several messages to a conversation in a single transaction."""
+        db = self.get_session()
+        try:
+            conv = db.query(ConversationModel).filter(ConversationModel.id == conversation_id).first()
+            if not conv:
+                return None
+            
+            existing = json.loads(conv.messages)
+            existing.extend(messages)
+            conv.messages = json.dumps(existing)
+            conv.updatedAt = datetime.now().isoformat()
+            
+            db.commit()
+            
+            return {
+                "id": conv.id,
+                "userId": conv.userId,
+                "messages": existing,
+                "createdAt": conv.createdAt,
+                "updatedAt": conv.updatedAt,
+            }
+        finally:
+            db.close()
+    
     def get_user_conversations(self, user_id: str) -> list:
         """Get all conversations for a user."""
         db = self.get_session()
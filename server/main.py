@@ -1,5 +1,7 @@
 import os
 import re
+import asyncio
+import orjson
 import uuid
 from datetime import datetime, timedelta
 from typing import Optional
@@ -7,7 +9,7 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException, Depends, Header, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, EmailStr
 import jwt
 import bcrypt
@@ -15,7 +17,8 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from agent import process_message, _infer_preference_memory_type
+from agent import client as openai_client, process_message, persistable_preferences, _infer_preference_memory_type
+from amadeus_client import amadeus_client
 from database import DatabaseStorage
 
 # ==================== Configuration ====================
@@ -34,7 +37,14 @@ except Exception:
 storage = DatabaseStorage()
 
 # ==================== FastAPI App ====================
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Release pooled Amadeus and OpenAI connections on shutdown.
+    await amadeus_client.aclose()
+    await openai_client.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS (dev-friendly defaults)
 app.add_middleware(
@@ -377,6 +387,14 @@ def _build_preferences_snapshot(user_id: str) -> dict:
         "count": sum(len(v) for v in (preferences or {}).values()),
     }
 
+# Chat-command gates; every chat turn runs these before reaching the agent.
+_MY_OR_CURRENT_RE = re.compile(r"\b(my|current)\b")
+_PREFERENCE_WORD_RE = re.compile(r"\b(preferences|preference)\b")
+_QUERY_VERB_RE = re.compile(r"\b(what|show|list|tell)\b")
+_DELETE_VERB_RE = re.compile(r"\b(forget|delete|remove|clear|wipe|reset)\b")
+_ALL_WORD_RE = re.compile(r"\b(all|everything)\b")
+
+
 def _handle_preference_query_command(user_id: str, message: str) -> Optional[dict]:
     """Handle natural-language queries like 'what are my current preferences?'"""
     if not isinstance(message, str):
@@ -388,9 +406,9 @@ def _handle_preference_query_command(user_id: str, message: str) -> Optional[dic
 
     lower = text.lower()
     if not (
-        re.search(r"\b(my|current)\b", lower)
-        and re.search(r"\b(preferences|preference)\b", lower)
-        and re.search(r"\b(what|show|list|tell)\b", lower)
+        _MY_OR_CURRENT_RE.search(lower)
+        and _PREFERENCE_WORD_RE.search(lower)
+        and _QUERY_VERB_RE.search(lower)
     ):
         return None
 
@@ -468,8 +486,7 @@ def _handle_preference_management_command(user_id: str, message: str) -> Optiona
     # Gate: only run if this looks like a delete/clear intent.
     # We intentionally do NOT require the word "preference" here because users often say
     # things like "delete my cabin class".
-    delete_verbs = r"(forget|delete|remove|clear|wipe|reset)"
-    if not re.search(rf"\b{delete_verbs}\b", lower):
+    if not _DELETE_VERB_RE.search(lower):
         return None
 
     from memory_manager import memory_manager
@@ -482,6 +499,7 @@ def _handle_preference_management_command(user_id: str, message: str) -> Optiona
                 continue
             try:
                 res = storage.delete_preference(user_id, t2)
+                memory_manager.bump_preferences_version(user_id)
                 if isinstance(res, dict) and res.get("success"):
                     deleted += int(res.get("deleted") or 0)
             except Exception as e:
@@ -489,7 +507,7 @@ def _handle_preference_management_command(user_id: str, message: str) -> Optiona
         return deleted
 
     # 1) Clear ALL preferences
-    if re.search(r"\b(all|everything)\b", lower) and re.search(r"\b(preferences|preference)\b", lower):
+    if _ALL_WORD_RE.search(lower) and _PREFERENCE_WORD_RE.search(lower):
         # Delete DB-backed preferences
         db_rows = storage.list_preferences(user_id) or []
         db_deleted = 0
@@ -630,7 +648,11 @@ def _handle_preference_management_command(user_id: str, message: str) -> Optiona
     return None
 
 @app.post("/api/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest, current_user: dict = Depends(get_current_user)):
+async def chat(
+    request: ChatRequest,
+    current_user: dict = Depends(get_current_user),
+    accept: Optional[str] = Header(None),
+):
     try:
         if not request.message.strip():
             raise HTTPException(
@@ -658,184 +680,195 @@ async def chat(request: ChatRequest, current_user: dict = Depends(get_current_us
                     detail="Access denied",
                 )
 
-        # Build conversation history
-        conversation_history = [
-            {"role": msg["role"], "content": msg["content"]}
-            for msg in conversation.get("messages", [])
-        ]
-
-        # Load user memories before processing (this will be included in system prompt)
-        # The agent's get_system_prompt_with_memory already handles this
-
-        # Natural-language: query current preferences (must match Active Preferences UI)
-        pref_query = _handle_preference_query_command(user_id, request.message)
-        if pref_query:
-            response_message = ChatMessageModel(
-                id=str(uuid.uuid4()),
-                role="assistant",
-                content=pref_query["content"],
-                timestamp=datetime.now().isoformat(),
-                flightResults=[],
-                memoryContext=None,
-                appliedPrefs=None,
-                travelHistory=None,
+        if accept and "text/event-stream" in accept:
+            return StreamingResponse(
+                _chat_event_stream(request, current_user, conversation_id, conversation),
+                media_type="text/event-stream",
             )
 
-            storage.add_message(conversation_id, {
+        payload = await _chat_turn(request, current_user, conversation_id, conversation)
+        return Response(content=orjson.dumps(payload), media_type="application/json")
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An error occurred: {str(e)}",
+        )
+
+
+async def _chat_event_stream(request: ChatRequest, current_user: dict, conversation_id: str, conversation: dict):
+    """Server-Sent Events for a chat turn: `delta` chunks of the reply, then a final `done` event
+    carrying the same payload as the JSON response."""
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def on_delta(delta: str) -> None:
+        await queue.put(delta)
+
+    turn = asyncio.create_task(_chat_turn(request, current_user, conversation_id, conversation, on_delta))
+    turn.add_done_callback(lambda _t: queue.put_nowait(None))
+
+    while (delta := await queue.get()) is not None:
+        yield f"data: {orjson.dumps({'delta': delta}).decode()}\n\n"
+
+    try:
+        payload = turn.result()
+    except Exception as e:
+        yield f"data: {orjson.dumps({'error': f'An error occurred: {str(e)}'}).decode()}\n\n"
+        return
+    yield f"data: {orjson.dumps({'done': True, **payload}).decode()}\n\n"
+
+
+async def _chat_turn(
+    request: ChatRequest,
+    current_user: dict,
+    conversation_id: str,
+    conversation: dict,
+    on_delta=None,
+) -> dict:
+    """Run one chat turn against an existing conversation and persist it."""
+    user_id = current_user["id"]
+
+    # Build conversation history (the agent only uses the last 10 turns)
+    conversation_history = [
+        {"role": msg["role"], "content": msg["content"]}
+        for msg in conversation.get("messages", [])[-10:]
+    ]
+
+    # Load user memories before processing (this will be included in system prompt)
+    # The agent's get_memory_prompt already handles this
+
+    # Natural-language: query current preferences (must match Active Preferences UI)
+    pref_query = _handle_preference_query_command(user_id, request.message)
+    if pref_query:
+        response_message = ChatMessageModel(
+            id=str(uuid.uuid4()),
+            role="assistant",
+            content=pref_query["content"],
+            timestamp=datetime.now().isoformat(),
+            flightResults=[],
+            memoryContext=None,
+            appliedPrefs=None,
+            travelHistory=None,
+        )
+
+        storage.add_messages(conversation_id, [
+            {
                 "id": str(uuid.uuid4()),
                 "role": "user",
                 "content": request.message,
                 "timestamp": datetime.now().isoformat(),
-            })
-            storage.add_message(conversation_id, response_message.model_dump())
-
-            return JSONResponse(
-                status_code=200,
-                content={
-                    "message": response_message.model_dump(),
-                    "conversationId": conversation_id,
-                    "extractedPreferences": [],
-                    "preferencesAction": pref_query.get("preferencesAction"),
-                },
-            )
+            },
+            response_message.model_dump(),
+        ])
 
-        # Natural-language preference management (delete/clear) without any UI buttons.
-        pref_cmd = _handle_preference_management_command(user_id, request.message)
-        if pref_cmd:
-            response_message = ChatMessageModel(
-                id=str(uuid.uuid4()),
-                role="assistant",
-                content=pref_cmd["content"],
-                timestamp=datetime.now().isoformat(),
-                flightResults=[],
-                memoryContext=None,
-                appliedPrefs=None,
-                travelHistory=None,
-            )
+        return {
+            "message": response_message.model_dump(),
+            "conversationId": conversation_id,
+            "extractedPreferences": [],
+            "preferencesAction": pref_query.get("preferencesAction"),
+        }
+
+    # Natural-language preference management (delete/clear) without any UI buttons.
+    pref_cmd = _handle_preference_management_command(user_id, request.message)
+    if pref_cmd:
+        response_message = ChatMessageModel(
+            id=str(uuid.uuid4()),
+            role="assistant",
+            content=pref_cmd["content"],
+            timestamp=datetime.now().isoformat(),
+            flightResults=[],
+            memoryContext=None,
+            appliedPrefs=None,
+            travelHistory=None,
+        )
 
-            storage.add_message(conversation_id, {
+        storage.add_messages(conversation_id, [
+            {
                 "id": str(uuid.uuid4()),
                 "role": "user",
                 "content": request.message,
                 "timestamp": datetime.now().isoformat(),
-            })
-            storage.add_message(conversation_id, response_message.model_dump())
-
-            return JSONResponse(
-                status_code=200,
-                content={
-                    "message": response_message.model_dump(),
-                    "conversationId": conversation_id,
-                    "extractedPreferences": [],
-                    "preferencesAction": pref_cmd.get("preferencesAction"),
-                },
-            )
-
-        # Process message with agent
-        result = process_message(
-            user_message=request.message,
-            user_id=user_id,
-            conversation_history=conversation_history,
-            current_preferences=request.currentPreferences or {},
-            username=current_user.get("username"),
-        )
+            },
+            response_message.model_dump(),
+        ])
 
-        # Extract preferences from the conversation
-        extracted_preferences = result.get("extracted_preferences", [])
-
-        # Avoid persisting ephemeral request phrasing as long-lived preferences.
-        # Example: "cheap flights" should influence the current search, but shouldn't
-        # permanently store a "budget conscious" preference unless the user expresses
-        # it as a stable constraint.
-        msg_lower = (request.message or "").lower()
-        filtered_extracted: list[str] = []
-        for pref in extracted_preferences or []:
-            if not isinstance(pref, str) or not pref.strip():
-                continue
+        return {
+            "message": response_message.model_dump(),
+            "conversationId": conversation_id,
+            "extractedPreferences": [],
+            "preferencesAction": pref_cmd.get("preferencesAction"),
+        }
 
-            pref_lower = pref.strip().lower()
-            if pref_lower == "budget conscious":
-                stable_budget = bool(
-                    re.search(
-                        r"\b(on\s+a\s+budget|tight\s+budget|budget[-\s]?friendly|budget[-\s]?conscious|as\s+cheap\s+as\s+possible|cheapest\s+possible)\b",
-                        msg_lower,
-                    )
-                )
-                if not stable_budget:
-                    continue
+    # Process message with agent
+    result = await process_message(
+        user_message=request.message,
+        user_id=user_id,
+        conversation_history=conversation_history,
+        current_preferences=request.currentPreferences or {},
+        username=current_user.get("username"),
+        on_delta=on_delta,
+    )
 
-            filtered_extracted.append(pref)
+    # Extract preferences from the conversation
+    extracted_preferences = result.get("extracted_preferences", [])
 
-        extracted_preferences = filtered_extracted
+    # Avoid persisting ephemeral request phrasing as long-lived preferences
+    # (same filter the agent applies before skipping background mem0 extraction).
+    extracted_preferences = persistable_preferences(extracted_preferences, (request.message or "").lower())
 
-        # Store extracted preferences in mem0/DB if any were found
-        from memory_manager import memory_manager
-        if extracted_preferences:
-            for pref in extracted_preferences:
-                pref_type = _infer_preference_memory_type(pref)
+    # Store extracted preferences in mem0/DB if any were found
+    from memory_manager import memory_manager
+    if extracted_preferences:
+        typed_preferences = []
+        for pref in extracted_preferences:
+            pref_type = _infer_preference_memory_type(pref)
+            typed_preferences.append((pref_type, pref))
 
-                # Always persist to DB for deterministic Active Preferences.
-                try:
-                    canonical = memory_manager._canonicalize_preference_text(
-                        memory_manager._strip_preference_wrappers(pref)
-                    )
-                    storage.add_preference(user_id, pref_type, pref, canonical)
-                except Exception as e:
-                    print(f"[PREFS] Warning: failed to persist extracted preference to DB: {e}")
-
-                if pref_type:
-                    try:
-                        memory_manager.add_structured_memory(
-                            user_id=user_id,
-                            category="preference",
-                            content=pref,
-                            memory_type=pref_type,
-                            metadata={"extracted_at": datetime.now().isoformat(), "source": "chat_extraction"},
-                        )
-                    except Exception as e:
-                        print(f"[PREFS] Warning: failed to persist extracted preference to mem0: {e}")
-                else:
-                    try:
-                        memory_manager.store_preference(user_id, "general", pref)
-                    except Exception as e:
-                        print(f"[PREFS] Warning: failed to store general preference to mem0: {e}")
+            # Always persist to DB for deterministic Active Preferences.
+            try:
+                canonical = memory_manager._canonicalize_preference_text(
+                    memory_manager._strip_preference_wrappers(pref)
+                )
+                storage.add_preference(user_id, pref_type, pref, canonical)
+            except Exception as e:
+                print(f"[PREFS] Warning: failed to persist extracted preference to DB: {e}")
+        memory_manager.bump_preferences_version(user_id)
 
-        response_message = ChatMessageModel(
-            id=str(uuid.uuid4()),
-            role="assistant",
-            content=result["content"],
-            timestamp=datetime.now().isoformat(),
-            flightResults=result.get("flight_results", []),
-            memoryContext=result.get("memory_context"),
-            appliedPrefs=result.get("applied_prefs_summary"),
-            travelHistory=result.get("travel_history"),
-        )
+        # One mem0 round-trip for the whole batch, off the event loop.
+        try:
+            await asyncio.to_thread(memory_manager.store_preferences, user_id, typed_preferences)
+        except Exception as e:
+            print(f"[PREFS] Warning: failed to persist extracted preferences to mem0: {e}")
+
+    response_message = ChatMessageModel(
+        id=str(uuid.uuid4()),
+        role="assistant",
+        content=result["content"],
+        timestamp=datetime.now().isoformat(),
+        flightResults=result.get("flight_results", []),
+        memoryContext=result.get("memory_context"),
+        appliedPrefs=result.get("applied_prefs_summary"),
+        travelHistory=result.get("travel_history"),
+    )
 
-        # Add messages to conversation
-        storage.add_message(conversation_id, {
+    # Add messages to conversation
+    storage.add_messages(conversation_id, [
+        {
             "id": str(uuid.uuid4()),
             "role": "user",
             "content": request.message,
             "timestamp": datetime.now().isoformat(),
-        })
-        storage.add_message(conversation_id, response_message.model_dump())
-
-        return JSONResponse(
-            status_code=200,
-            content={
-                "message": response_message.model_dump(),
-                "conversationId": conversation_id,
-                "extractedPreferences": extracted_preferences,
-            },
-        )
+        },
+        response_message.model_dump(),
+    ])
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"An error occurred: {str(e)}",
-        )
+    return {
+        "message": response_message.model_dump(),
+        "conversationId": conversation_id,
+        "extractedPreferences": extracted_preferences,
+    }
 
 @app.get("/api/conversations/{conversation_id}", response_model=ConversationModel)
 async def get_conversation(
@@ -944,6 +977,7 @@ async def delete_all_conversations(request_body: DeleteAllConversationsRequest,
                             continue
                         try:
                             res = storage.delete_preference(user_id, txt)
+                            memory_manager.bump_preferences_version(user_id)
                             if isinstance(res, dict) and res.get("success"):
                                 db_deleted += int(res.get("deleted") or 0)
                         except Exception as e:
@@ -1093,6 +1127,7 @@ async def get_user_preferences(current_user: dict = Depends(get_current_user)):
             for txt in unique_lux:
                 try:
                     storage.delete_preference(user_id, txt)
+                    memory_manager.bump_preferences_version(user_id)
                 except Exception as e:
                     print(f"[PREFS CLEANUP] DB delete failed for '{txt}': {e}")
                 try:
@@ -1209,6 +1244,7 @@ async def add_preference(request: dict, current_user: dict = Depends(get_current
             memory_manager._strip_preference_wrappers(content)
         )
         db_row = storage.add_preference(user_id, memory_type, content, canonical)
+        memory_manager.bump_preferences_version(user_id)
         if isinstance(db_row, dict) and db_row.get("error"):
             raise HTTPException(status_code=500, detail=db_row.get("error"))
         
@@ -1239,6 +1275,7 @@ async def delete_preference(preference_text: str, current_user: dict = Depends(g
         db_deleted = False
         try:
             db_result = storage.delete_preference(user_id, preference_text)
+            memory_manager.bump_preferences_version(user_id)
             if db_result.get("success"):
                 db_deleted = True
             if canonical and canonical != preference_text:
@@ -1282,6 +1319,7 @@ async def record_booking(request: dict, current_user: dict = Depends(get_current
         # 1) Persist deterministically to DB so travel history always shows all bookings.
         try:
             storage.add_booking(current_user["id"], request)
+            memory_manager.bump_preferences_version(current_user["id"])
         except Exception as e:
             # Don't fail booking recording if DB persistence fails; mem0 still acts as a fallback.
             print(f"[BOOKING] Warning: failed to persist booking to DB: {e}")
@@ -1309,9 +1347,16 @@ async def get_travel_history(current_user: dict = Depends(get_current_user)):
 # ==================== Run Server ====================
 if __name__ == "__main__":
     import uvicorn
+    # Single process only: the preferences version that invalidates the cached
+    # summaries/prompts is per process, so with several workers a preference
+    # deleted through one would keep being applied to searches on the others.
+    # uvicorn reads WEB_CONCURRENCY itself, so workers=1 must be passed explicitly.
+    if os.environ.get("WEB_CONCURRENCY", "").strip() not in ("", "1"):
+        print("[SERVER] WEB_CONCURRENCY is not supported (per-process preference caches); running one worker")
     uvicorn.run(
         app,
         host="0.0.0.0",
         port=PYTHON_BACKEND_PORT,
         log_level="info",
+        workers=1,
     )
@@ -1,16 +1,27 @@
 import os
 import re
-from typing import Optional, List, Dict, Literal
+import logging
+from typing import Optional, List, Dict, Literal, Tuple
 from datetime import datetime
 
 from database import DatabaseStorage
 
+logger = logging.getLogger(__name__)
+
 # Memory Schema Types
 PreferenceType = Literal["seat", "airline", "departure_time", "flight_type", "cabin_class", "red_eye", "baggage"]
 MemoryCategory = Literal["preference", "travel_history", "route", "airline", "budget"]
 
 _db_storage = DatabaseStorage()
 
+# Preference text cleanup, applied per stored preference when summarizing.
+_PREFERENCE_PREFIX_RE = re.compile(r"^\s*(travel\s+preference|preference)\s*:\s*", re.IGNORECASE)
+_TYPE_SUFFIX_RE = re.compile(r"\s*\(\s*type\s*:\s*[^)]+\)\s*$", re.IGNORECASE)
+_LEADING_PREFER_RE = re.compile(r"^\s*i\s+(prefer|like|love|want|need)\s+", re.IGNORECASE)
+# Booking-shaped memories that summarize_preferences skips.
+_BOOKING_WITH_PRICE_RE = re.compile(r"from\s+[A-Z]{3}\s+to\s+[A-Z]{3}.*with\s+\w+.*(?:USD|EUR|GBP|\$)", re.IGNORECASE)
+_FLIGHT_FROM_TO_RE = re.compile(r"flight\s+from\s+[A-Z]{3}\s+to\s+[A-Z]{3}", re.IGNORECASE)
+
 class TravelMemory:
     """Standard schema for travel memories."""
     
@@ -61,6 +72,17 @@ class TravelMemoryManager:
     def __init__(self):
         self._memory = None
         self._initialized = False
+        # Per-user counter bumped on every preference/memory write; lets callers
+        # cache prompt data derived from memories until something changes.
+        self._prefs_version: Dict[str, int] = {}
+    
+    def get_preferences_version(self, user_id: str) -> int:
+        """Return the current preference version for a user."""
+        return self._prefs_version.get(user_id, 0)
+    
+    def bump_preferences_version(self, user_id: str) -> None:
+        """Mark a user's stored preferences/memories as changed."""
+        self._prefs_version[user_id] = self._prefs_version.get(user_id, 0) + 1
     
     def _get_memory(self):
         """Lazy initialization of mem0 to avoid startup delays."""
@@ -121,7 +143,7 @@ class TravelMemoryManager:
                 except TypeError:
                     results = memory.search(search_query, filters=filters)
 
-            print(f"[MEMORY] Search results: {results}")
+            logger.debug("[MEMORY] Search results: %s", results)
 
             # MemoryClient.search() returns {"results": [memory_list]}
             if isinstance(results, dict):
@@ -144,7 +166,7 @@ class TravelMemoryManager:
 
             print(f"[MEMORY] Retrieved {len(filtered_memories)} memories for user {user_id} (filtered from {len(memories)})")
             if filtered_memories:
-                print(f"[MEMORY] Sample memory structure: {filtered_memories[0] if filtered_memories else 'None'}")
+                logger.debug("[MEMORY] Sample memory structure: %s", filtered_memories[0])
             return filtered_memories
         except Exception as e:
             print(f"[MEMORY ERROR] Error retrieving memories for user {user_id}: {e}")
@@ -170,10 +192,10 @@ class TravelMemoryManager:
         
         try:
             print(f"[MEMORY] Adding {len(messages)} message(s) to memory for user {user_id}")
-            print(f"[MEMORY] Messages: {messages}")
+            logger.debug("[MEMORY] Messages: %s", messages)
             result = memory.add(messages, user_id=user_id)
-            print(f"[MEMORY] Successfully added memory, result: {result}")
-            print(f"[MEMORY] Result type: {type(result)}, Keys: {result.keys() if isinstance(result, dict) else 'N/A'}")
+            self.bump_preferences_version(user_id)
+            logger.debug("[MEMORY] Successfully added memory, result: %s", result)
             return {"success": True, "result": result}
         except Exception as e:
             print(f"[MEMORY ERROR] Error adding memory for user {user_id}: {e}")
@@ -200,6 +222,25 @@ class TravelMemoryManager:
         print(f"[MEMORY] Store preference result: {result}")
         return result
     
+    def store_preferences(self, user_id: str, preferences: List[Tuple[Optional[str], str]]) -> Dict:
+        """
+        Store several preferences with a single mem0 call.
+        
+        Args:
+            user_id: The user identifier
+            preferences: (memory_type, text) pairs; a None type is stored as a general preference
+        """
+        messages: List[Dict] = []
+        for memory_type, text in preferences:
+            if memory_type:
+                messages.append(TravelMemory(user_id, "preference", text, memory_type).to_message_format())
+            else:
+                messages.append({"role": "user", "content": f"Preference: general - {text}"})
+        if not messages:
+            return {"success": True, "result": None}
+        print(f"[MEMORY] Storing {len(preferences)} preference(s) for user {user_id} in one call")
+        return self.add_memory(user_id, messages)
+    
     def store_travel_history(self, user_id: str, flight_details: Dict):
         """
         Store a completed flight booking/travel.
@@ -299,7 +340,7 @@ class TravelMemoryManager:
                 context_parts.extend([f"- {h}" for h in travel_history])
             
             result = "\n".join(context_parts) if context_parts else ""
-            print(f"[CONTEXT] Final context: {result}")
+            logger.debug("[CONTEXT] Final context: %s", result)
             return result
         except Exception as e:
             print(f"[CONTEXT ERROR] Error getting user context: {e}")
@@ -307,7 +348,13 @@ class TravelMemoryManager:
             traceback.print_exc()
             return ""
     
-    def extract_and_store_preferences(self, user_id: str, user_message: str, assistant_response: str):
+    def extract_and_store_preferences(
+        self,
+        user_id: str,
+        user_message: str,
+        assistant_response: str,
+        prefilled_prefs: Optional[List[str]] = None,
+    ):
         """
         Extract and store preferences from a conversation turn.
         
@@ -315,7 +362,13 @@ class TravelMemoryManager:
             user_id: The user identifier
             user_message: The user's message
             assistant_response: The assistant's response
+            prefilled_prefs: Preferences already extracted from this message and
+                persisted by the caller; when non-empty the mem0 pass is skipped
         """
+        if prefilled_prefs:
+            print(f"[MEMORY] Skipping turn extraction for user {user_id}: {len(prefilled_prefs)} preference(s) already stored")
+            return False
+
         messages = [
             {"role": "user", "content": user_message},
             {"role": "assistant", "content": assistant_response}
@@ -452,9 +505,9 @@ class TravelMemoryManager:
     def _strip_preference_wrappers(memory_text: str) -> str:
         text = (memory_text or "").strip()
         # Remove common wrappers added by our own memory formatting.
-        text = re.sub(r"^\s*(travel\s+preference|preference)\s*:\s*", "", text, flags=re.IGNORECASE)
+        text = _PREFERENCE_PREFIX_RE.sub("", text)
         # Remove trailing type annotation wrapper.
-        text = re.sub(r"\s*\(\s*type\s*:\s*[^)]+\)\s*$", "", text, flags=re.IGNORECASE)
+        text = _TYPE_SUFFIX_RE.sub("", text)
         return text.strip()
 
     @staticmethod
@@ -534,7 +587,7 @@ class TravelMemoryManager:
             return "Travel: With partner"
 
         # Airline: keep as-is (too many variations); just strip leading phrasing.
-        t = re.sub(r"^\s*i\s+(prefer|like|love|want|need)\s+", "", t, flags=re.IGNORECASE).strip()
+        t = _LEADING_PREFER_RE.sub("", t).strip()
         return t
     
     def summarize_preferences(self, user_id: str, include_ids: bool = False) -> Dict:
@@ -557,7 +610,7 @@ class TravelMemoryManager:
                 ),
                 limit=150,
             )
-            print(f"[MEMORY] Raw memories retrieved: {all_memories}")
+            logger.debug("[MEMORY] Raw memories retrieved: %s", all_memories)
             
             summary = {
                 "seat": [],
@@ -610,12 +663,12 @@ class TravelMemoryManager:
                     continue
                 
                 # Skip memories that look like flight bookings (pattern: "from ABC to XYZ with AIRLINE in CLASS for CURRENCY PRICE")
-                if re.search(r'from\s+[A-Z]{3}\s+to\s+[A-Z]{3}.*with\s+\w+.*(?:USD|EUR|GBP|\$)', memory_text, re.IGNORECASE):
+                if _BOOKING_WITH_PRICE_RE.search(memory_text):
                     print(f"[MEMORY] Skipping travel booking pattern (not a preference): '{memory_text}'")
                     continue
                 
                 # Skip entries with "flight from X to Y" pattern (another variant of flight booking)
-                if re.search(r'flight\s+from\s+[A-Z]{3}\s+to\s+[A-Z]{3}', memory_text, re.IGNORECASE):
+                if _FLIGHT_FROM_TO_RE.search(memory_text):
                     print(f"[MEMORY] Skipping flight booking format (flight from X to Y): '{memory_text}'")
                     continue
                 
@@ -635,72 +688,72 @@ class TravelMemoryManager:
                 else:
                     entry = display_text
                 
-                print(f"[MEMORY] Processing memory: '{memory_text}' (lower: '{memory_lower}')")
+                logger.debug("[MEMORY] Processing memory: '%s'", memory_text)
                 
                 # Categorize the memory - Check cabin class FIRST since it's most specific
                 if any(word in display_lower for word in ["business", "economy", "premium", "first"]) and any(word in display_lower for word in ["class", "cabin"]):
-                    print(f"  -> Categorized as CABIN CLASS")
+                    logger.debug("  -> Categorized as CABIN CLASS")
                     if display_lower not in seen_by_category["cabin_class"]:
                         seen_by_category["cabin_class"].add(display_lower)
                         summary["cabin_class"].append(entry)
                 elif any(word in display_lower for word in ["red-eye", "red eye", "red-eye:"]):
-                    print(f"  -> Categorized as RED EYE")
+                    logger.debug("  -> Categorized as RED EYE")
                     if display_lower not in seen_by_category["red_eye"]:
                         seen_by_category["red_eye"].add(display_lower)
                         summary["red_eye"].append(entry)
                 elif any(word in display_lower for word in ["round trip", "one-way", "round-trip", "one way", "trip type:"]):
-                    print(f"  -> Categorized as TRIP TYPE")
+                    logger.debug("  -> Categorized as TRIP TYPE")
                     if display_lower not in seen_by_category["trip_type"]:
                         seen_by_category["trip_type"].add(display_lower)
                         summary["trip_type"].append(entry)
                 elif any(word in display_lower for word in ["direct", "non-stop", "layover", "stop", "stops:"]):
-                    print(f"  -> Categorized as FLIGHT TYPE")
+                    logger.debug("  -> Categorized as FLIGHT TYPE")
                     if display_lower not in seen_by_category["flight_type"]:
                         seen_by_category["flight_type"].add(display_lower)
                         summary["flight_type"].append(entry)
                 elif any(word in display_lower for word in ["morning", "afternoon", "evening", "depart", "departure time:"]):
-                    print(f"  -> Categorized as TIME")
+                    logger.debug("  -> Categorized as TIME")
                     if display_lower not in seen_by_category["departure_time"]:
                         seen_by_category["departure_time"].add(display_lower)
                         summary["departure_time"].append(entry)
                 elif any(word in display_lower for word in ["traveling alone", "solo", "travel alone", "fly alone", "traveling with family", "traveling with kids", "traveling with children", "traveling with partner", "traveling with spouse", "family trip", "travel:"]):
-                    print(f"  -> Categorized as PASSENGER")
+                    logger.debug("  -> Categorized as PASSENGER")
                     if display_lower not in seen_by_category["passenger"]:
                         seen_by_category["passenger"].add(display_lower)
                         summary["passenger"].append(entry)
                 elif any(word in display_lower for word in ["seat", "window", "aisle", "middle", "exit row", "seat:"]):
-                    print(f"  -> Categorized as SEAT")
+                    logger.debug("  -> Categorized as SEAT")
                     if display_lower not in seen_by_category["seat"]:
                         seen_by_category["seat"].add(display_lower)
                         summary["seat"].append(entry)
                 elif any(word in display_lower for word in ["airline", "carrier", "united", "delta", "american", "southwest", "jetblue", "alaska", "spirit", "frontier"]):
-                    print(f"  -> Categorized as AIRLINE")
+                    logger.debug("  -> Categorized as AIRLINE")
                     if display_lower not in seen_by_category["airline"]:
                         seen_by_category["airline"].add(display_lower)
                         summary["airline"].append(entry)
                 elif any(word in display_lower for word in ["baggage", "luggage", "bag", "carry-on", "checked", "baggage:"]):
-                    print(f"  -> Categorized as BAGGAGE")
+                    logger.debug("  -> Categorized as BAGGAGE")
                     if display_lower not in seen_by_category["baggage"]:
                         seen_by_category["baggage"].add(display_lower)
                         summary["baggage"].append(entry)
                 elif any(word in display_lower for word in ["budget", "price", "cost"]) and "general" not in display_lower and "budget-conscious" not in display_lower:
                     # Only add specific budget preferences (e.g., "max $500"), skip generic "budget-conscious"
-                    print(f"  -> Categorized as BUDGET")
+                    logger.debug("  -> Categorized as BUDGET")
                     if display_lower not in seen_by_category["budget"]:
                         seen_by_category["budget"].add(display_lower)
                         summary["budget"].append(entry)
                 elif any(word in memory_lower for word in ["live", "based", "from", "home"]) and any(word in memory_lower for word in ["houston", "newyork", "los angeles", "london", "paris", "tokyo", "delhi", "mumbai", "kathmandu", "beijing", "chicago", "miami", "seattle", "boston", "denver", "dallas", "austin", "sanfrancisco"]):
-                    print(f"  -> Categorized as LOCATION")
+                    logger.debug("  -> Categorized as LOCATION")
                     if display_lower not in seen_by_category["location"]:
                         seen_by_category["location"].add(display_lower)
                         summary["location"].append(entry)
                 else:
-                    print(f"  -> Categorized as OTHER")
+                    logger.debug("  -> Categorized as OTHER")
                     if display_lower not in seen_by_category["other"]:
                         seen_by_category["other"].add(display_lower)
                         summary["other"].append(entry)
             
-            print(f"[MEMORY] Final summary: {summary}")
+            logger.debug("[MEMORY] Final summary: %s", summary)
 
             # Merge DB-backed preferences so preference reads are deterministic.
             try:
@@ -894,6 +947,7 @@ class TravelMemoryManager:
             print(f"[MEMORY] Deleting memory {memory_id} for user {user_id}")
             # mem0's MemoryClient.delete() method only takes memory_id
             result = memory.delete(memory_id)
+            self.bump_preferences_version(user_id)
             print(f"[MEMORY] Delete result: {result}")
             return {"success": True, "result": result}
         except Exception as e:
@@ -1016,7 +1070,8 @@ class TravelMemoryManager:
                         return result
             
             print(f"[MEMORY] Could not find preference matching: {preference_text}")
-            print(f"[MEMORY] Available preferences: {[m.get('memory', '') for m in all_memories]}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[MEMORY] Available preferences: %s", [m.get("memory", "") for m in all_memories])
             return {"error": f"Preference '{preference_text}' not found"}
         except Exception as e:
             print(f"[MEMORY ERROR] Error removing preference for user {user_id}: {e}")